@@ -0,0 +1,194 @@
+"""
+Offline benchmark of the RAG pipelines.
+
+Gemini, the embedding model, Pinecone, the web search provider and the cross-encoder are replaced by the deterministic stand-ins of
+`benchmark.stubs`, with configurable latency, so runs are reproducible and need no network or API keys.
+
+Run from the api directory:
+    python -m benchmark.run --pipelines adaptive crag self_rag app --concurrency 1 4 16 --requests 40 --output report.json
+"""
+import re
+import json
+import time
+import asyncio
+import argparse
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from .stubs import LatencyModel, StubReranker, install
+
+QUERIES = [
+    "How can I make people like me instantly?",
+    "What is the best way to handle an argument?",
+    "Why should I avoid criticizing others?",
+    "How do I get someone to see things from my point of view?",
+    "What does Carnegie say about remembering names?",
+    "How can I change people without giving offense?",
+    "Why is it important to talk in terms of the other person's interests?",
+    "How should I admit my own mistakes?",
+    "What is the secret of dealing with people?",
+    "How can I become a better listener?",
+    "How do I encourage someone to improve?",
+    "Why should I let the other person do most of the talking?",
+]
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def pipeline_runner(name: str, args) -> Callable[[str], Awaitable[Optional[int]]]:
+    """
+    An async function running one request of `name` for a query and returning its LLM call count.
+    Service pipelines are called directly inside their own trace; "app" goes through the FastAPI app in-process.
+    """
+    from monitoring import tracing as tracing
+
+    def traced(call: Callable[[str], Awaitable[Any]]) -> Callable[[str], Awaitable[int]]:
+        async def run(query: str) -> int:
+            # Each request runs in its own task, so the trace does not leak between requests
+            trace = tracing.start_trace()
+            await call(query)
+            return trace.llm_calls
+        return run
+
+    if name == "adaptive":
+        from service import search as search
+        return traced(lambda query: search.get_adaptive_query_engine().answer(query, args.k, True, "Auto"))
+    if name == "crag":
+        from service.crag import crag as crag
+        return traced(lambda query: crag.crag_process(query, args.k))
+    if name == "self_rag":
+        from service.self_rag import self_rag as self_rag
+        return traced(lambda query: self_rag.self_rag(query, args.k))
+    if name == "app":
+        import httpx
+        from main import app
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark", timeout=None)
+        endpoints = ["/search/adaptive_query/{}?query_category=Auto", "/search/crag/{}", "/search/self_rag/{}"]
+
+        async def run(query: str) -> Optional[int]:
+            endpoint = endpoints[QUERIES.index(query) % len(endpoints)] if query in QUERIES else endpoints[0]
+            response = await client.get(endpoint.format(query), headers={"X-Debug-Timing": "1"})
+            response.raise_for_status()
+            llm_calls = re.search(r"llm_calls;count=(\d+)", response.headers.get("X-Debug-Timing", ""))
+            return int(llm_calls.group(1)) if llm_calls else None
+        return run
+    raise ValueError(f"Unknown pipeline: {name}")
+
+
+async def run_level(run: Callable[[str], Awaitable[Optional[int]]], concurrency: int, requests: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    llm_calls: List[int] = []
+    errors: List[str] = []
+    semaphore = asyncio.Semaphore(concurrency)
+    # Largest delay of a 10 ms heartbeat: anything blocking the event loop (a sync sleep, CPU work) shows up here
+    lags: List[float] = [0.0]
+    done = asyncio.Event()
+
+    async def heartbeat():
+        while not done.is_set():
+            before = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lags.append(time.perf_counter() - before - 0.01)
+
+    async def one(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                calls = await run(QUERIES[i % len(QUERIES)])
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}")
+                return
+            latencies.append(time.perf_counter() - start)
+            if calls is not None:
+                llm_calls.append(calls)
+
+    monitor = asyncio.create_task(heartbeat())
+    start = time.perf_counter()
+    await asyncio.gather(*(asyncio.create_task(one(i)) for i in range(requests)))
+    wall = time.perf_counter() - start
+    done.set()
+    await monitor
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+        "throughput_rps": len(latencies) / wall if wall > 0 else 0.0,
+        "llm_calls_per_request": sum(llm_calls) / len(llm_calls) if llm_calls else None,
+        "max_loop_lag_ms": max(lags) * 1000,
+    }
+
+
+def print_report(report: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None):
+    print(f"{'pipeline':<10} {'conc':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8} {'llm/req':>8} {'lag ms':>7} {'errors':>7}")
+    for name, levels in report["results"].items():
+        for level in levels:
+            llm = "-" if level["llm_calls_per_request"] is None else f"{level['llm_calls_per_request']:.2f}"
+            line = (f"{name:<10} {level['concurrency']:>5} {level['p50_ms']:>9.1f} {level['p95_ms']:>9.1f} {level['p99_ms']:>9.1f} "
+                    f"{level['throughput_rps']:>8.2f} {llm:>8} {level.get('max_loop_lag_ms', 0.0):>7.1f} {level['errors']:>7}")
+            previous = next((old for old in (baseline or {}).get("results", {}).get(name, [])
+                             if old["concurrency"] == level["concurrency"]), None)
+            if previous and previous["p50_ms"] and previous["p95_ms"]:
+                line += (f"   p50 {100 * (level['p50_ms'] / previous['p50_ms'] - 1):+.0f}%"
+                         f" p95 {100 * (level['p95_ms'] / previous['p95_ms'] - 1):+.0f}%")
+            print(line)
+            if level["first_error"]:
+                print(f"{'':<10} first error: {level['first_error']}")
+
+
+async def main(args):
+    install(llm_latency=LatencyModel.parse(args.llm_latency, args.seed),
+            embedding_latency=LatencyModel.parse(args.embedding_latency, args.seed + 1),
+            vector_latency=LatencyModel.parse(args.vector_latency, args.seed + 2),
+            web_latency=LatencyModel.parse(args.web_latency, args.seed + 3),
+            reranker=None if args.real_rerank else StubReranker(),
+            off_topic_rate=args.off_topic_rate,
+            keep_rate_limits=args.keep_rate_limits or args.rpm is not None,
+            requests_per_minute=args.rpm,
+            answer_cache=args.answer_cache)
+
+    results: Dict[str, List[Dict[str, Any]]] = {}
+    for name in args.pipelines:
+        run = pipeline_runner(name, args)
+        results[name] = [await run_level(run, concurrency, args.requests) for concurrency in args.concurrency]
+
+    report = {"settings": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+              "results": results}
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline latency and throughput benchmark of the RAG pipelines.")
+    parser.add_argument("--pipelines", nargs="+", default=["adaptive", "crag", "self_rag", "app"],
+                        choices=["adaptive", "crag", "self_rag", "app"])
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=40, help="Requests per pipeline and concurrency level")
+    parser.add_argument("--k", type=int, default=4, help="Documents retrieved per request")
+    parser.add_argument("--llm-latency", default="400:0.3", help="LLM call latency as median_ms[:sigma] (log-normal)")
+    parser.add_argument("--embedding-latency", default="10:0.2")
+    parser.add_argument("--vector-latency", default="30:0.3")
+    parser.add_argument("--web-latency", default="600:0.4")
+    parser.add_argument("--off-topic-rate", type=float, default=0.0, help="Share of queries routed to the plain LLM")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--real-rerank", action="store_true", help="Use the real cross-encoder instead of the stub")
+    parser.add_argument("--keep-rate-limits", action="store_true", help="Keep the configured Gemini rate limits")
+    parser.add_argument("--rpm", type=float, help="Rate limit every Gemini model to this many requests per minute (implies --keep-rate-limits)")
+    parser.add_argument("--answer-cache", action="store_true", help="Leave the semantic answer cache enabled")
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    parser.add_argument("--baseline", help="A previous JSON report to compare p50/p95 against")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,284 @@
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+from typing import Any, AsyncIterator, ClassVar, Dict, List, Optional, Tuple
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+from langchain_core.vectorstores import VectorStore
+from service.web_search import WebSearchProvider
+
+
+def stable_hash(text: str) -> int:
+    return int(hashlib.sha1(text.encode("utf-8")).hexdigest()[:8], 16)
+
+
+class LatencyModel:
+    """
+    Log-normal latency with the given median (ms) and spread, from a seeded generator so runs are reproducible.
+    """
+    def __init__(self, median_ms: float, sigma: float = 0.0, seed: int = 0):
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self.random = random.Random(seed)
+
+    @classmethod
+    def parse(cls, spec: str, seed: int = 0) -> "LatencyModel":
+        """Parse "median_ms[:sigma]", e.g. "400:0.3"."""
+        median, _, sigma = spec.partition(":")
+        return cls(float(median), float(sigma or 0.0), seed)
+
+    def sample(self) -> float:
+        """A latency in seconds."""
+        if self.median_ms <= 0:
+            return 0.0
+        if self.sigma <= 0:
+            return self.median_ms / 1000
+        return self.random.lognormvariate(0.0, self.sigma) * self.median_ms / 1000
+
+
+# Deterministic answers for the structured outputs of the pipelines, keyed by schema name then field.
+# Each function gets a seed derived from the prompt, so the same prompt always takes the same branch.
+STRUCTURED_RESPONSES = {
+    "relation_check": {"check": lambda seed, n: True},
+    "categories_options": {"category": lambda seed, n: "Factual" if seed % 2 else "Analytical"},
+    "RetrievalResponse": {"response": lambda seed, n: "Yes"},
+    "RelevanceResponse": {"response": lambda seed, n: "Irrelevant" if seed % 4 == 0 else "Relevant"},
+    "BatchRelevanceResponse": {"responses": lambda seed, n: ["Irrelevant" if (seed >> i) % 4 == 0 else "Relevant" for i in range(n)]},
+    "SupportResponse": {"response": lambda seed, n: "Fully supported"},
+    "UtilityResponse": {"response": lambda seed, n: 1 + seed % 5},
+    "RetrievalEvaluatorInput": {"relevance_score": lambda seed, n: (seed % 100) / 100},
+    "BatchRetrievalEvaluatorInput": {"relevance_scores": lambda seed, n: [((seed >> i) % 100) / 100 for i in range(n)]},
+}
+
+def stub_field_value(schema_name: str, field_name: str, field: Any, seed: int, count: int) -> Any:
+    override = STRUCTURED_RESPONSES.get(schema_name, {}).get(field_name)
+    if override is not None:
+        return override(seed, count)
+    item_type = field.type_
+    if item_type is bool:
+        value = True
+    elif item_type is int:
+        value = 1 + seed % 5
+    elif item_type is float:
+        value = (seed % 100) / 100
+    else:
+        value = f"stub {field_name} {seed % 1000}"
+    # shape 2 is a List[...] field
+    return [value] * count if field.shape == 2 else value
+
+
+class StubChatModel(BaseChatModel):
+    """
+    Stand-in for ChatGoogleGenerativeAI: sleeps for a sampled latency and answers deterministically from the prompt.
+    Accepts the same constructor arguments as `chat_model` passes, so it goes through the rate limiter and callbacks unchanged.
+    Structured output is produced by the model itself (as JSON), so those calls are traced and counted like real ones.
+    """
+    model: str = "stub"
+    temperature: float = 0.7
+    top_p: Optional[float] = None
+
+    # Shared by every instance; set by `install`
+    latency: ClassVar[LatencyModel] = LatencyModel(0.0)
+    off_topic_rate: ClassVar[float] = 0.0
+    answer_words: ClassVar[int] = 120
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub-chat"
+
+    def respond(self, messages: List[BaseMessage], structured_schema: Optional[type] = None) -> AIMessage:
+        prompt = "\n".join(str(message.content) for message in messages)
+        seed = stable_hash(prompt)
+        if structured_schema is not None:
+            numbered = re.search(r"following (\d+) numbered", prompt)
+            count = int(numbered.group(1)) if numbered else 3
+            name = structured_schema.__name__
+            values = {field_name: stub_field_value(name, field_name, field, seed, count)
+                      for field_name, field in structured_schema.__fields__.items()}
+            if name == "relation_check" and (seed % 1000) / 1000 < StubChatModel.off_topic_rate:
+                values["check"] = False
+            content = json.dumps(values)
+        elif re.search(r"(\d+) queries, one per line", prompt):
+            count = int(re.search(r"(\d+) queries, one per line", prompt).group(1))
+            content = "\n".join(f"generated query {(seed + i) % 997} about {prompt[-40:].strip()}" for i in range(count))
+        else:
+            words = [f"word{(seed + i) % 997}" for i in range(StubChatModel.answer_words)]
+            content = " ".join(words)
+        usage = {"input_tokens": len(prompt) // 4, "output_tokens": len(content) // 4,
+                 "total_tokens": (len(prompt) + len(content)) // 4}
+        return AIMessage(content=content, usage_metadata=usage)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        time.sleep(StubChatModel.latency.sample())
+        message = self.respond(messages, kwargs.get("structured_schema"))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(StubChatModel.latency.sample())
+        message = self.respond(messages, kwargs.get("structured_schema"))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        # The sampled latency is spread evenly over the lines (or groups of 10 words) of the answer
+        message = self.respond(messages, kwargs.get("structured_schema"))
+        if "\n" in message.content:
+            pieces = [line + "\n" for line in message.content.split("\n")]
+        else:
+            words = message.content.split(" ")
+            pieces = [" ".join(words[i:i + 10]) + " " for i in range(0, len(words), 10)]
+        latency = StubChatModel.latency.sample()
+        for i, piece in enumerate(pieces):
+            await asyncio.sleep(latency / len(pieces))
+            usage = message.usage_metadata if i == len(pieces) - 1 else None
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece, usage_metadata=usage))
+
+    def with_structured_output(self, schema, *, include_raw: bool = False, **kwargs: Any):
+        return self.bind(structured_schema=schema) | RunnableLambda(lambda message: schema(**json.loads(message.content)))
+
+
+class StubEmbeddings(Embeddings):
+    """Hash-seeded unit vectors with a sampled latency per batch."""
+    def __init__(self, size: int = 384, latency: Optional[LatencyModel] = None):
+        self.size = size
+        self.latency = latency or LatencyModel(0.0)
+
+    def vector(self, text: str) -> List[float]:
+        generator = random.Random(stable_hash(text))
+        vector = [generator.gauss(0.0, 1.0) for _ in range(self.size)]
+        norm = sum(value * value for value in vector) ** 0.5
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency.sample())
+        return [self.vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class StubVectorStore(VectorStore):
+    """
+    Stand-in for PineconeVectorStore over a synthetic corpus with the book's metadata layout.
+    A search returns `k` chunks picked deterministically from the query vector, after a sampled network latency.
+    """
+    def __init__(self, embedding: Embeddings, corpus_size: int = 500, latency: Optional[LatencyModel] = None):
+        self.embedding = embedding
+        self.latency = latency or LatencyModel(0.0)
+        self.documents = [
+            Document(page_content=f"Chunk {i} of part {i % 4 + 1}: " + " ".join(f"term{(i * 7 + j) % 211}" for j in range(80)),
+                     metadata={"topic": f"Part {i % 4 + 1}", "title": f"Chapter {i % 30 + 1}", "principle": f"Principle {i % 9 + 1}"},
+                     id=f"chunk-{i}")
+            for i in range(corpus_size)
+        ]
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    def add_texts(self, texts, metadatas=None, **kwargs) -> List[str]:
+        raise NotImplementedError("StubVectorStore is read-only")
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, **kwargs):
+        raise NotImplementedError("StubVectorStore is read-only")
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        time.sleep(self.latency.sample())
+        generator = random.Random(stable_hash(",".join(f"{value:.4f}" for value in embedding[:8])))
+        picks = generator.sample(range(len(self.documents)), min(k, len(self.documents)))
+        return [(self.documents[i], 0.9 - rank * 0.05) for rank, i in enumerate(picks)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self.embedding.embed_query(query), k)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    async def asimilarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return await asyncio.to_thread(self.similarity_search_with_score, query, k)
+
+
+class StubReranker:
+    """Deterministic cross-encoder logits with a fixed cost per batch plus a cost per pair."""
+    def __init__(self, batch_ms: float = 5.0, pair_ms: float = 0.5):
+        self.batch_ms = batch_ms
+        self.pair_ms = pair_ms
+
+    def __call__(self, pairs: List[Tuple[str, str]], batch_size: Optional[int] = None) -> List[float]:
+        batches = -(-len(pairs) // batch_size) if batch_size else 1
+        time.sleep((self.batch_ms * batches + self.pair_ms * len(pairs)) / 1000)
+        return [(stable_hash(query + "\0" + passage) % 2000) / 250 - 4 for query, passage in pairs]
+
+
+class StubWebSearch(WebSearchProvider):
+    """Stand-in web search provider: synthetic results after a sampled latency."""
+    name = "stub"
+
+    def __init__(self, latency: Optional[LatencyModel] = None):
+        self.latency = latency or LatencyModel(0.0)
+
+    def search(self, query: str, max_results: int) -> List[dict]:
+        time.sleep(self.latency.sample())
+        seed = stable_hash(query)
+        return [{"title": f"Result {(seed + i) % 100}", "link": f"https://example.org/{(seed + i) % 100}",
+                 "snippet": f"Snippet about {query} number {i}."} for i in range(max_results)]
+
+
+def install(llm_latency: LatencyModel, embedding_latency: LatencyModel, vector_latency: LatencyModel,
+            web_latency: LatencyModel, reranker: Optional[StubReranker] = None,
+            off_topic_rate: float = 0.0, keep_rate_limits: bool = False, answer_cache: bool = False,
+            requests_per_minute: Optional[float] = None):
+    """
+    Swap Gemini, the embedding model, Pinecone, the web search provider and (optionally) the cross-encoder for the stubs above.
+    Must run before any request, since the service builds its clients lazily on first use.
+    With `keep_rate_limits`, `requests_per_minute` replaces the configured request limit of every model.
+    """
+    from config import config as config
+    from data.pinecone import init as db
+    from service import llm as llm
+    from service import ratelimit as ratelimit
+    from service import rerank as rerank
+    from service import search as service_search
+    from service import web_search as web_search
+
+    StubChatModel.latency = llm_latency
+    StubChatModel.off_topic_rate = off_topic_rate
+    llm.ChatGoogleGenerativeAI = StubChatModel
+
+    if not keep_rate_limits:
+        rate_limit_config = config.get_rate_limit_config()
+        rate_limit_config['models'] = {}
+        rate_limit_config['default'] = {'requests_per_minute': 10 ** 9}
+        ratelimit.rate_limiters.clear()
+    elif requests_per_minute is not None:
+        rate_limit_config = config.get_rate_limit_config()
+        for limits in [rate_limit_config.setdefault('default', {}), *rate_limit_config.get('models', {}).values()]:
+            limits['requests_per_minute'] = requests_per_minute
+        ratelimit.rate_limiters.clear()
+
+    db.embeddings = StubEmbeddings(latency=embedding_latency)
+    db.vectorstore = StubVectorStore(db.embeddings, latency=vector_latency)
+
+    stub_web_search = StubWebSearch(latency=web_latency)
+    web_search.get_provider = lambda: stub_web_search
+    # Every request pays the web search latency, as on a cold cache
+    web_search.cache_config['enabled'] = False
+
+    if reranker is not None:
+        rerank.predict_logits = reranker
+        rerank.batcher.score_fn = reranker
+
+    service_search.answer_cache_config['enabled'] = answer_cache
+    # Benchmark rewards come from stub latencies, they must not end up in the persisted bandit state
+    service_search.bandit.bandit_config['path'] = None
@@ -1,7 +1,52 @@
-from .init import database_config, llm_model_config
+from .init import database_config, llm_model_config, rate_limit_config, grading_config, crag_config, rerank_config, answer_cache_config, routing_config, local_classifier_config, llm_profiles_config, adaptive_retrieval_config, ingestion_config, context_packing_config, strategy_bandit_config, single_flight_config, batch_config, web_search_config
 
 def get_database_config():
     return database_config
 
 def get_llm_model_config():
-    return llm_model_config
\ No newline at end of file
+    return llm_model_config
+
+def get_rate_limit_config():
+    return rate_limit_config
+
+def get_grading_config():
+    return grading_config
+
+def get_crag_config():
+    return crag_config
+
+def get_rerank_config():
+    return rerank_config
+
+def get_answer_cache_config():
+    return answer_cache_config
+
+def get_routing_config():
+    return routing_config
+
+def get_local_classifier_config():
+    return local_classifier_config
+
+def get_llm_profiles_config():
+    return llm_profiles_config
+
+def get_adaptive_retrieval_config():
+    return adaptive_retrieval_config
+
+def get_ingestion_config():
+    return ingestion_config
+
+def get_context_packing_config():
+    return context_packing_config
+
+def get_strategy_bandit_config():
+    return strategy_bandit_config
+
+def get_single_flight_config():
+    return single_flight_config
+
+def get_batch_config():
+    return batch_config
+
+def get_web_search_config():
+    return web_search_config
\ No newline at end of file
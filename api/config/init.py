@@ -9,13 +9,44 @@ config_file = os.path.join(script_dir, 'cfg.yaml')
 
 database_config  = None 
 llm_model_config = None 
+rate_limit_config = None 
+grading_config = None 
+crag_config = None 
+rerank_config = None 
+answer_cache_config = None 
+routing_config = None 
+local_classifier_config = None 
+llm_profiles_config = None 
+adaptive_retrieval_config = None 
+ingestion_config = None 
+context_packing_config = None 
+strategy_bandit_config = None 
+single_flight_config = None 
+batch_config = None 
+web_search_config = None 
 def get_config():
-    global database_config, llm_model_config
+    global database_config, llm_model_config, rate_limit_config, grading_config, crag_config, rerank_config, answer_cache_config, routing_config, local_classifier_config, llm_profiles_config, adaptive_retrieval_config, ingestion_config, context_packing_config, strategy_bandit_config, single_flight_config, batch_config, web_search_config
     # Load the YAML configuration file
     with open(config_file, 'r') as file:
         config = yaml.safe_load(file)
         # Extracting configurations
-    database_config = config[0]
-    llm_model_config = config[1]
+    sections = {section['name']: section for section in config}
+    database_config = sections['database']
+    llm_model_config = sections['llm_model']
+    rate_limit_config = sections.get('rate_limits', {})
+    grading_config = sections.get('grading', {})
+    crag_config = sections.get('crag', {})
+    rerank_config = sections.get('rerank', {})
+    answer_cache_config = sections.get('answer_cache', {})
+    routing_config = sections.get('routing', {})
+    local_classifier_config = sections.get('local_classifier', {})
+    llm_profiles_config = sections.get('llm_profiles', {})
+    adaptive_retrieval_config = sections.get('adaptive_retrieval', {})
+    ingestion_config = sections.get('ingestion', {})
+    context_packing_config = sections.get('context_packing', {})
+    strategy_bandit_config = sections.get('strategy_bandit', {})
+    single_flight_config = sections.get('single_flight', {})
+    batch_config = sections.get('batch', {})
+    web_search_config = sections.get('web_search', {})
     
 get_config()
\ No newline at end of file
@@ -0,0 +1,166 @@
+import os
+import time
+import array
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from langchain_core.embeddings import Embeddings
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper with a two-tier cache keyed by (model name, kind, normalized text):
+    a bounded in-process LRU in front of an SQLite store that survives restarts and is shared by every worker process.
+    The lock only guards the LRU; every thread reads and writes SQLite through its own connection.
+    The store is pruned every `prune_interval_s` of rows unused for `ttl_days`, then of the least recently used rows
+    beyond `max_disk_entries`. A disk hit only writes its new last_used back once it is `touch_interval_hours` stale,
+    so reads of hot keys do not turn into a write per lookup.
+    """
+    def __init__(self, underlying: Embeddings, model_name: str, path: Optional[str] = None, memory_size: int = 4096,
+                 max_disk_entries: int = 200000, ttl_days: float = 30, prune_interval_s: float = 600,
+                 touch_interval_hours: float = 24):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.memory_size = memory_size
+        self.memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+        self.ttl_seconds = ttl_days * 86400
+        self.prune_interval_s = prune_interval_s
+        self.touch_interval_s = touch_interval_hours * 3600
+        self.last_prune = time.monotonic()
+        self._local = threading.local()
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            db = self.connection()
+            db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL DEFAULT 0)")
+            # Stores written before pruning existed have no last_used column
+            if "last_used" not in [row[1] for row in db.execute("PRAGMA table_info(embeddings)")]:
+                db.execute("ALTER TABLE embeddings ADD COLUMN last_used REAL NOT NULL DEFAULT 0")
+            db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            db.commit()
+
+    def connection(self) -> Optional[sqlite3.Connection]:
+        if not self.path:
+            return None
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            # WAL lets several uvicorn workers read while one of them writes; NORMAL skips the fsync of every commit
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def key(self, text: str, kind: str) -> str:
+        return hashlib.sha1(f"{self.model_name}\0{kind}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def memory_get(self, key: str) -> Optional[List[float]]:
+        vector = self.memory.get(key)
+        if vector is not None:
+            self.memory.move_to_end(key)
+        return vector
+
+    def memory_put(self, key: str, vector: List[float]):
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    def disk_get(self, keys: List[str]) -> Dict[str, List[float]]:
+        db = self.connection()
+        if db is None or not keys:
+            return {}
+        placeholders = ",".join("?" * len(keys))
+        rows = db.execute(f"SELECT key, vector, last_used FROM embeddings WHERE key IN ({placeholders})", keys).fetchall()
+        now = time.time()
+        stale = [key for key, _, last_used in rows if now - last_used >= self.touch_interval_s]
+        if stale:
+            # Rows read back are recently used again, pruning by age keeps them
+            db.execute(f"UPDATE embeddings SET last_used = ? WHERE key IN ({','.join('?' * len(stale))})", [now] + stale)
+            db.commit()
+        return {key: array.array("f", vector).tolist() for key, vector, _ in rows}
+
+    def disk_put(self, items: Dict[str, List[float]]):
+        db = self.connection()
+        if db is None or not items:
+            return
+        now = time.time()
+        db.executemany("INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                       [(key, array.array("f", vector).tobytes(), now) for key, vector in items.items()])
+        db.commit()
+        if time.monotonic() - self.last_prune >= self.prune_interval_s:
+            self.last_prune = time.monotonic()
+            self.prune(db)
+
+    def prune(self, db: sqlite3.Connection):
+        expired = db.execute("DELETE FROM embeddings WHERE last_used < ?", (time.time() - self.ttl_seconds,)).rowcount
+        excess = db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - self.max_disk_entries
+        if excess > 0:
+            db.execute("DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,))
+        db.commit()
+        print(f"Embedding cache pruned : {expired} expired and {max(excess, 0)} least recently used entries")
+
+    def embed(self, texts: List[str], kind: str) -> List[List[float]]:
+        keys = [self.key(text, kind) for text in texts]
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            for key in keys:
+                vector = self.memory_get(key)
+                if vector is not None:
+                    found[key] = vector
+            self.counters["memory_hits"] += sum(1 for key in keys if key in found)
+        # Disk reads and writes happen outside the lock, on this thread's connection
+        on_disk = self.disk_get([key for key in set(keys) if key not in found])
+        with self._lock:
+            self.counters["disk_hits"] += sum(1 for key in keys if key in on_disk)
+            for key, vector in on_disk.items():
+                self.memory_put(key, vector)
+        found.update(on_disk)
+
+        # Embed each missing text once, in a single forward pass
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        if missing:
+            if kind == "query" and len(missing) == 1:
+                computed = [self.underlying.embed_query(next(iter(missing.values())))]
+            elif kind == "query":
+                computed = [self.underlying.embed_query(text) for text in missing.values()]
+            else:
+                computed = self.underlying.embed_documents(list(missing.values()))
+            # Round to float32 so memory and disk hits return exactly the same vectors
+            computed = {key: array.array("f", vector).tolist() for key, vector in zip(missing.keys(), computed)}
+            with self._lock:
+                self.counters["misses"] += sum(1 for key in keys if key in computed)
+                for key, vector in computed.items():
+                    self.memory_put(key, vector)
+            self.disk_put(computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed(texts, "document")
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed([text], "query")[0]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = sum(self.counters.values())
+            hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+            return {
+                **self.counters,
+                "memory_entries": len(self.memory),
+                "hit_rate": hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,257 @@
+"""
+Incremental ingestion of source documents into the configured vector store.
+
+Run from the api directory:
+    python -m data.ingest path/to/book.jsonl [more files or directories] [--prune] [--full] [--dry-run]
+
+Sources are .jsonl files (one section per line: "text" plus its topic / title / principle metadata)
+or .txt / .md files (one section per file, titled after the file name).
+Sections are split into chunks whose id is a hash of the embedding model, the text and the metadata.
+The manifest records the chunk ids of every ingested source, so a re-run only embeds and upserts new chunks
+and deletes the chunks that disappeared from the re-ingested sources.
+"""
+import os
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from config import config as config
+from data.pinecone import init as db
+
+database_config = config.get_database_config()
+ingestion_config = config.get_ingestion_config()
+
+METADATA_FIELDS = ("topic", "title", "principle")
+
+
+def read_sections(path: str) -> Iterator[Tuple[str, dict]]:
+    """Stream the (text, metadata) sections of a source file."""
+    if path.endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                text = record.pop("text", None) or record.pop("page_content", "")
+                metadata = record.pop("metadata", None) or record
+                yield text, metadata
+    else:
+        with open(path, "r", encoding="utf-8") as file:
+            title = os.path.splitext(os.path.basename(path))[0]
+            yield file.read(), {"topic": os.path.basename(os.path.dirname(path)), "title": title, "principle": ""}
+
+def source_files(paths: List[str]) -> Iterator[str]:
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if name.endswith((".jsonl", ".txt", ".md")):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+def chunk_id(model_name: str, text: str, metadata: dict) -> str:
+    content = "\0".join([model_name, text, json.dumps(metadata, sort_keys=True, ensure_ascii=False)])
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+def iter_chunks(path: str, splitter: RecursiveCharacterTextSplitter, model_name: str) -> Iterator[dict]:
+    for text, metadata in read_sections(path):
+        metadata = {**{field: "" for field in METADATA_FIELDS}, **metadata}
+        for chunk in splitter.split_text(text):
+            yield {"id": chunk_id(model_name, chunk, metadata), "page_content": chunk, "metadata": metadata}
+
+
+class Manifest:
+    """Chunk ids of every ingested source, for the vector store, index and embedding model they were written to."""
+
+    def __init__(self, path: str, target: dict):
+        self.path = path
+        self.target = target
+        self.sources: Dict[str, List[str]] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+            if data.get("target") == target:
+                self.sources = data.get("sources", {})
+            else:
+                print(f"Manifest {path} was written for {data.get('target')}, re-ingesting everything")
+
+    def chunk_ids(self) -> Set[str]:
+        return {chunk for chunks in self.sources.values() for chunk in chunks}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".tmp", "w", encoding="utf-8") as file:
+            json.dump({"target": self.target, "sources": self.sources}, file)
+        os.replace(self.path + ".tmp", self.path)
+
+
+class LocalSink:
+    """
+    Buffers the upserts for the LocalVectorStore, which rewrites its files on every change, and applies them in one write.
+    """
+    def __init__(self, vectorstore):
+        self.vectorstore = vectorstore
+        self.chunks: List[dict] = []
+        self.vectors: List[List[float]] = []
+
+    def upsert(self, chunks: List[dict], vectors: List[List[float]]):
+        self.chunks += chunks
+        self.vectors += vectors
+
+    def delete(self, ids: List[str]):
+        self.vectorstore.delete(ids)
+
+    def flush(self):
+        if self.chunks:
+            self.vectorstore.add_embeddings([chunk["page_content"] for chunk in self.chunks], self.vectors,
+                                            [chunk["metadata"] for chunk in self.chunks], [chunk["id"] for chunk in self.chunks])
+
+
+class PineconeSink:
+    """
+    Upserts precomputed vectors to the Pinecone index `index_name`, in requests of `batch_size` vectors.
+    The chunk text goes in the `text_key` metadata field, where PineconeVectorStore reads it back.
+    """
+    def __init__(self, index_name: str, batch_size: int, namespace: Optional[str] = None, text_key: str = "text"):
+        from pinecone import Pinecone
+        # The API key comes from PINECONE_API_KEY, as for the service's PineconeVectorStore
+        self.index = Pinecone().Index(index_name)
+        self.batch_size = batch_size
+        self.namespace = namespace
+        self.text_key = text_key
+
+    def upsert(self, chunks: List[dict], vectors: List[List[float]]):
+        records = [(chunk["id"], vector, {**chunk["metadata"], self.text_key: chunk["page_content"]})
+                   for chunk, vector in zip(chunks, vectors)]
+        for start in range(0, len(records), self.batch_size):
+            self.index.upsert(vectors=records[start:start + self.batch_size], namespace=self.namespace)
+
+    def delete(self, ids: List[str]):
+        for start in range(0, len(ids), self.batch_size):
+            self.index.delete(ids=ids[start:start + self.batch_size], namespace=self.namespace)
+
+    def flush(self):
+        pass
+
+
+def update_corpus(path: str, new_chunks: List[dict], deleted: Set[str]):
+    """Keep the BM25 corpus (database.sparse.corpus) in sync when it is not the local index's own metadata file."""
+    records: Dict[str, dict] = {}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as file:
+            for line in file:
+                if line.strip():
+                    record = json.loads(line)
+                    records[record["id"]] = record
+    for chunk_id in deleted:
+        records.pop(chunk_id, None)
+    for chunk in new_chunks:
+        records[chunk["id"]] = chunk
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as file:
+        for record in records.values():
+            file.write(json.dumps(record, ensure_ascii=False) + "\n")
+    os.replace(path + ".tmp", path)
+
+
+def ingest(paths: List[str], prune: bool = False, full: bool = False, dry_run: bool = False):
+    start = time.perf_counter()
+    backend = database_config.get('backend', 'pinecone')
+    model_name = database_config['embedding_model']
+    index = database_config['local']['path'] if backend == 'local' else database_config['environment']['index_name']
+    manifest = Manifest(ingestion_config.get('manifest', 'data/ingest_manifest.json'),
+                        {"backend": backend, "index": index, "embedding_model": model_name})
+    # Chunks already in the index; with --full they are all embedded again
+    previous = manifest.chunk_ids()
+    indexed = set() if full else previous
+    splitter = RecursiveCharacterTextSplitter(chunk_size=ingestion_config.get('chunk_size', 1000),
+                                              chunk_overlap=ingestion_config.get('chunk_overlap', 100))
+    batch_size = ingestion_config.get('batch_size', 256)
+
+    embedding_model = None
+    sink = None
+    if not dry_run:
+        # Fast tokenizers encode each batch on all cores
+        os.environ.setdefault("TOKENIZERS_PARALLELISM", "true")
+        embedding_model = db.get_embeddings()
+        # Documents are embedded once, they have nothing to gain from the query embedding cache
+        embedding_model = getattr(embedding_model, "underlying", embedding_model)
+        if hasattr(embedding_model, "encode_kwargs"):
+            embedding_model.encode_kwargs = {**embedding_model.encode_kwargs, "batch_size": batch_size}
+        if backend == 'local':
+            sink = LocalSink(db.get_vectorstore())
+        else:
+            sink = PineconeSink(index, ingestion_config.get('upsert_batch_size', 100))
+
+    # Upserts run on their own thread, overlapping with the embedding of the next batch
+    upserter = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest_upsert")
+    upserts: List[Future] = []
+    pending: List[dict] = []
+    new_chunks: List[dict] = []
+    queued: Set[str] = set()
+    total = 0
+
+    def flush_pending():
+        if pending and not dry_run:
+            vectors = embedding_model.embed_documents([chunk["page_content"] for chunk in pending])
+            upserts.append(upserter.submit(sink.upsert, list(pending), vectors))
+        pending.clear()
+
+    sources: Dict[str, List[str]] = {}
+    for path in source_files(paths):
+        ids = []
+        for chunk in iter_chunks(path, splitter, model_name):
+            total += 1
+            ids.append(chunk["id"])
+            if chunk["id"] in indexed or chunk["id"] in queued:
+                continue
+            queued.add(chunk["id"])
+            pending.append(chunk)
+            new_chunks.append(chunk)
+            if len(pending) >= batch_size:
+                flush_pending()
+        sources[path] = ids
+        print(f"{path}: {len(ids)} chunks")
+    flush_pending()
+
+    updated = {**manifest.sources, **sources}
+    if prune:
+        updated = sources
+    still_used = {chunk for chunks in updated.values() for chunk in chunks}
+    deleted = sorted(previous - still_used)
+
+    if not dry_run:
+        for upsert in upserts:
+            upsert.result()
+        upserter.shutdown()
+        if deleted:
+            sink.delete(deleted)
+        sink.flush()
+        manifest.sources = updated
+        manifest.save()
+        # The default corpus is the local index's own metadata file: the local store already wrote it,
+        # and ingesting into Pinecone must not rewrite the local index behind its back
+        corpus = database_config.get('sparse', {}).get('corpus')
+        local_metadata = os.path.join(database_config['local']['path'], 'metadata.jsonl')
+        if corpus and os.path.abspath(corpus) == os.path.abspath(local_metadata):
+            if backend != 'local':
+                print(f"BM25 corpus {corpus} is the local index's metadata, left as is; point database.sparse.corpus elsewhere to keep it in sync")
+        elif corpus:
+            update_corpus(corpus, new_chunks, set(deleted))
+
+    print(f"{'Would ingest' if dry_run else 'Ingested'} {total} chunks from {len(sources)} sources in {time.perf_counter() - start:.1f}s: "
+          f"{len(new_chunks)} embedded and upserted, {total - len(new_chunks)} unchanged, {len(deleted)} deleted")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chunk, embed and upsert source documents into the configured vector store.")
+    parser.add_argument("paths", nargs="+", help="Source files (.jsonl, .txt, .md) or directories")
+    parser.add_argument("--prune", action="store_true", help="Delete the chunks of manifest sources that are not in this run")
+    parser.add_argument("--full", action="store_true", help="Ignore the manifest and re-embed everything")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be embedded and deleted")
+    args = parser.parse_args()
+    ingest(args.paths, prune=args.prune, full=args.full, dry_run=args.dry_run)
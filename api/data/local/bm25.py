@@ -0,0 +1,116 @@
+import re
+import json
+import numpy as np
+from typing import Dict, List, Tuple
+from langchain.docstore.document import Document
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+STOPWORDS = frozenset("""a an and are as at be but by can do does for from how i if in into is it its me my of on or
+so that the their them then there these they this to was we what when where which who why will with you your""".split())
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    In-memory BM25 inverted index over the chunks of the book.
+
+    Postings are stored in CSR layout: the postings of term t are doc_ids[offsets[t]:offsets[t + 1]]
+    with their term frequencies in tfs, so a query only touches the postings of its own terms.
+    The title / principle / topic metadata is indexed with the chunk text, `metadata_weight` times,
+    so queries quoting a principle title match its chunks.
+    """
+
+    def __init__(self, records: List[dict], k1: float = 1.5, b: float = 0.75, metadata_weight: int = 2):
+        self.k1 = k1
+        self.b = b
+        self.records = records
+        postings: Dict[str, Dict[int, int]] = {}
+        lengths = np.zeros(len(records), dtype=np.float32)
+        # Chunks of the same title / principle share their metadata tokens; confidence compares across groups
+        groups: Dict[Tuple[str, str], int] = {}
+        self.group_ids = np.zeros(len(records), dtype=np.int32)
+        for doc_id, record in enumerate(records):
+            metadata = record.get("metadata", {})
+            self.group_ids[doc_id] = groups.setdefault((str(metadata.get("title", "")), str(metadata.get("principle", ""))), len(groups))
+            tokens = tokenize(record.get("page_content", ""))
+            for field in ("title", "principle", "topic"):
+                tokens += tokenize(str(metadata.get(field, ""))) * metadata_weight
+            lengths[doc_id] = len(tokens)
+            for token in tokens:
+                counts = postings.setdefault(token, {})
+                counts[doc_id] = counts.get(doc_id, 0) + 1
+
+        self.vocabulary = {term: term_id for term_id, term in enumerate(postings)}
+        self.offsets = np.zeros(len(postings) + 1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum([len(counts) for counts in postings.values()])
+        self.doc_ids = np.empty(self.offsets[-1], dtype=np.int32)
+        self.tfs = np.empty(self.offsets[-1], dtype=np.float32)
+        for term_id, counts in enumerate(postings.values()):
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            self.doc_ids[start:end] = list(counts.keys())
+            self.tfs[start:end] = list(counts.values())
+
+        document_frequency = np.diff(self.offsets).astype(np.float32)
+        self.idf = np.log1p((len(records) - document_frequency + 0.5) / (document_frequency + 0.5))
+        self.length_norm = (1 - b + b * lengths / max(float(lengths.mean()) if len(records) else 1.0, 1e-6)).astype(np.float32)
+
+    @classmethod
+    def from_jsonl(cls, path: str, **kwargs) -> "BM25Index":
+        """Build the index from a metadata.jsonl file of the local index layout (id, page_content, metadata per line)."""
+        with open(path, "r", encoding="utf-8") as file:
+            return cls([json.loads(line) for line in file if line.strip()], **kwargs)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def scores(self, query: str) -> Tuple[np.ndarray, float]:
+        """
+        BM25 score of every chunk for `query`, and the highest score a chunk could reach
+        (every query term matched with a large term frequency), used to normalize confidence.
+        """
+        scores = np.zeros(len(self.records), dtype=np.float32)
+        upper_bound = 0.0
+        for term in set(tokenize(query)):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            doc_ids, tfs = self.doc_ids[start:end], self.tfs[start:end]
+            # Each chunk appears once in a posting list, so plain fancy-index accumulation is safe
+            scores[doc_ids] += self.idf[term_id] * tfs * (self.k1 + 1) / (tfs + self.k1 * self.length_norm[doc_ids])
+            upper_bound += float(self.idf[term_id]) * (self.k1 + 1)
+        return scores, upper_bound
+
+    def document(self, doc_id: int) -> Document:
+        record = self.records[doc_id]
+        return Document(page_content=record.get("page_content", ""), metadata=record.get("metadata", {}), id=record.get("id"))
+
+    def search(self, query: str, k: int = 4) -> List[Tuple[Document, float]]:
+        scores, _ = self.scores(query)
+        return self.top_k(scores, k)
+
+    def top_k(self, scores: np.ndarray, k: int) -> List[Tuple[Document, float]]:
+        k = min(k, int(np.count_nonzero(scores)))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.document(int(doc_id)), float(scores[doc_id])) for doc_id in top]
+
+    def confident_search(self, query: str, k: int, min_score: float, min_ratio: float) -> Tuple[List[Tuple[Document, float]], bool]:
+        """
+        Top-k lexical results and whether the best match is confident: its score normalized by the query's
+        upper bound is at least `min_score` and it beats the best chunk of any other title / principle by `min_ratio`.
+        """
+        scores, upper_bound = self.scores(query)
+        results = self.top_k(scores, k)
+        if not results or upper_bound <= 0:
+            return results, False
+        best_id = int(np.argmax(scores))
+        best = float(scores[best_id])
+        others = scores[self.group_ids != self.group_ids[best_id]]
+        runner_up = float(others.max()) if len(others) else 0.0
+        confident = best / upper_bound >= min_score and best >= min_ratio * runner_up
+        return results, confident
@@ -0,0 +1,171 @@
+import os
+import json
+import uuid
+import numpy as np
+from typing import Any, Iterable, List, Optional, Tuple
+from langchain.docstore.document import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+EMBEDDINGS_FILE = "embeddings.npy"
+METADATA_FILE = "metadata.jsonl"
+
+
+class LocalVectorStore(VectorStore):
+    """
+    In-process vector index over a memory-mapped embedding matrix.
+
+    The index directory holds two files:
+        embeddings.npy  : (n, dim) float32/float16 matrix of L2-normalized embeddings, opened with mmap_mode="r".
+        metadata.jsonl  : one line per row with the chunk id, page_content and metadata (topic, title, principle).
+
+    Scores are cosine similarities computed as a single dot product over the matrix.
+    The matrix and its records are swapped as one `state` reference, so a search never pairs the rows of one
+    version of the index with the records of another.
+    """
+
+    def __init__(self, embedding: Embeddings, path: str, dtype: str = "float32"):
+        self.embedding = embedding
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.state: Tuple[np.ndarray, List[dict]] = (np.zeros((0, 0), dtype=self.dtype), [])
+        self.load()
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self.state[0]
+
+    @property
+    def records(self) -> List[dict]:
+        return self.state[1]
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    def load(self):
+        embeddings_file = os.path.join(self.path, EMBEDDINGS_FILE)
+        metadata_file = os.path.join(self.path, METADATA_FILE)
+        if not os.path.exists(embeddings_file):
+            print(f"Local index not found at {self.path}, starting empty")
+            return
+        matrix = np.load(embeddings_file, mmap_mode="r")
+        with open(metadata_file, "r", encoding="utf-8") as file:
+            records = [json.loads(line) for line in file if line.strip()]
+        if len(records) != matrix.shape[0]:
+            raise ValueError(f"Local index at {self.path} is corrupted: "
+                             f"{matrix.shape[0]} embeddings for {len(records)} metadata records")
+        self.state = (matrix, records)
+
+    def save(self, matrix: np.ndarray, records: List[dict]):
+        os.makedirs(self.path, exist_ok=True)
+        embeddings_file = os.path.join(self.path, EMBEDDINGS_FILE)
+        metadata_file = os.path.join(self.path, METADATA_FILE)
+        matrix = matrix.astype(self.dtype)
+        # Write to temporary files first so readers never see a half written index
+        with open(embeddings_file + ".tmp", "wb") as file:
+            np.save(file, matrix)
+        with open(metadata_file + ".tmp", "w", encoding="utf-8") as file:
+            for record in records:
+                file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        # Serve the new index from memory while the files are replaced. This also releases the memory map of the old file,
+        # which Windows cannot replace while it is still mapped
+        self.state = (matrix, records)
+        os.replace(embeddings_file + ".tmp", embeddings_file)
+        os.replace(metadata_file + ".tmp", metadata_file)
+        # Back to a memory map, of the new file
+        self.load()
+
+    @staticmethod
+    def normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def add_embeddings(self, texts: List[str], vectors: List[List[float]],
+                       metadatas: Optional[List[dict]] = None, ids: Optional[List[str]] = None) -> List[str]:
+        """
+        Upsert precomputed embeddings. Rows with an existing id are replaced in place, new ids are appended.
+        """
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        new_rows = self.normalize(np.asarray(vectors, dtype=np.float32))
+
+        matrix = np.array(self.matrix, dtype=np.float32) if len(self.records) else np.zeros((0, new_rows.shape[1]), dtype=np.float32)
+        records = list(self.records)
+        positions = {record["id"]: i for i, record in enumerate(records)}
+        appended = []
+        for row, text, metadata, id in zip(new_rows, texts, metadatas, ids):
+            record = {"id": id, "page_content": text, "metadata": metadata}
+            if id in positions:
+                matrix[positions[id]] = row
+                records[positions[id]] = record
+            else:
+                positions[id] = len(records)
+                records.append(record)
+                appended.append(row)
+        if appended:
+            matrix = np.vstack([matrix, np.stack(appended)])
+        self.save(matrix, records)
+        return ids
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        vectors = self.embedding.embed_documents(texts)
+        return self.add_embeddings(texts, vectors, metadatas, ids)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if not ids:
+            return False
+        ids = set(ids)
+        keep = [i for i, record in enumerate(self.records) if record["id"] not in ids]
+        if len(keep) == len(self.records):
+            return False
+        self.save(np.asarray(self.matrix[keep], dtype=np.float32), [self.records[i] for i in keep])
+        return True
+
+    def top_k(self, matrix: np.ndarray, vector: List[float], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        if not matrix.shape[0]:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        query = self.normalize(np.asarray(vector, dtype=np.float32)).astype(matrix.dtype)
+        scores = matrix @ query
+        k = min(k, len(scores))
+        if k < len(scores):
+            indices = np.argpartition(-scores, k - 1)[:k]
+        else:
+            indices = np.arange(len(scores))
+        indices = indices[np.argsort(-scores[indices])]
+        return indices, scores[indices]
+
+    @staticmethod
+    def to_document(record: dict) -> Document:
+        return Document(id=record["id"], page_content=record["page_content"], metadata=record["metadata"])
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        matrix, records = self.state
+        indices, scores = self.top_k(matrix, embedding, k)
+        return [(self.to_document(records[i]), float(score)) for i, score in zip(indices, scores)]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self.embedding.embed_query(query), k)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    async def asimilarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        # In-process search is far cheaper than a thread hop, run it inline
+        return self.similarity_search_by_vector(embedding, k)
+
+    def _select_relevance_score_fn(self):
+        return lambda score: (score + 1.0) / 2.0
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   ids: Optional[List[str]] = None, path: str = "data/local/index", dtype: str = "float32",
+                   **kwargs: Any) -> "LocalVectorStore":
+        store = cls(embedding=embedding, path=path, dtype=dtype)
+        store.add_texts(texts, metadatas, ids)
+        return store
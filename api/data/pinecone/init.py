@@ -1,19 +1,20 @@
 import os
+import threading
 import torch
 from langchain_huggingface import HuggingFaceEmbeddings
 from dotenv import load_dotenv
-from langchain_pinecone import PineconeVectorStore
 from config import config as config
+from data.embedding_cache import CachedEmbeddings
 
 load_dotenv()
 
 vectorstore = None
 embeddings = None
+sparse_index = None
+sparse_index_loaded = False
+_lock = threading.Lock()
 
-def pineconedb_init():
-    global  vectorstore, embeddings
-    
-    #embeddings
+def embeddings_init():
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     model_name = config.get_database_config()['embedding_model'] #"BAAI/bge-small-en-v1.5"
     model_kwargs = {'device': device}
@@ -23,9 +24,69 @@ def pineconedb_init():
         model_kwargs=model_kwargs,
         encode_kwargs=encode_kwargs,
     )
-    
-    #DB
-    index_name = config.get_database_config()['environment']['index_name'] #"ai-doc"
-    vectorstore = PineconeVectorStore(embedding = embeddings, index_name = index_name)
+    cache_config = config.get_database_config().get('embedding_cache', {})
+    if not cache_config.get('enabled', False):
+        return embeddings
+    return CachedEmbeddings(embeddings, model_name,
+                            path = cache_config.get('path'),
+                            memory_size = cache_config.get('memory_size', 4096),
+                            max_disk_entries = cache_config.get('max_disk_entries', 200000),
+                            ttl_days = cache_config.get('ttl_days', 30),
+                            touch_interval_hours = cache_config.get('touch_interval_hours', 24))
 
-pineconedb_init()
\ No newline at end of file
+def vectorstore_init(embeddings):
+    backend = config.get_database_config().get('backend', 'pinecone') # "pinecone" | "local"
+    if backend == 'local':
+        from data.local.index import LocalVectorStore
+        local_config = config.get_database_config()['local']
+        return LocalVectorStore(embedding = embeddings, path = local_config['path'], dtype = local_config.get('dtype', 'float32'))
+    if backend == 'pinecone':
+        from langchain_pinecone import PineconeVectorStore
+        index_name = config.get_database_config()['environment']['index_name'] #"ai-doc"
+        return PineconeVectorStore(embedding = embeddings, index_name = index_name)
+    raise ValueError(f"Unknown vector store backend: {backend}")
+
+# The embedding model and the vector store are loaded on first use (or by the startup warm-up), not at import time
+def get_embeddings():
+    global embeddings
+    if embeddings is None:
+        with _lock:
+            if embeddings is None:
+                embeddings = embeddings_init()
+    return embeddings
+
+def get_vectorstore():
+    global vectorstore
+    if vectorstore is None:
+        embeddings = get_embeddings()
+        with _lock:
+            if vectorstore is None:
+                vectorstore = vectorstore_init(embeddings)
+    return vectorstore
+
+def sparse_index_init():
+    sparse_config = config.get_database_config().get('sparse', {})
+    if not sparse_config.get('enabled', False):
+        return None
+    corpus = sparse_config.get('corpus', os.path.join(config.get_database_config()['local']['path'], 'metadata.jsonl'))
+    if not os.path.exists(corpus):
+        print(f"BM25 corpus not found at {corpus}, hybrid retrieval falls back to dense")
+        return None
+    from data.local.bm25 import BM25Index
+    return BM25Index.from_jsonl(corpus, k1 = sparse_config.get('k1', 1.5), b = sparse_config.get('b', 0.75),
+                                metadata_weight = sparse_config.get('metadata_weight', 2))
+
+def get_sparse_index():
+    """The BM25 index, or None when it is disabled or has no corpus."""
+    global sparse_index, sparse_index_loaded
+    if not sparse_index_loaded:
+        with _lock:
+            if not sparse_index_loaded:
+                sparse_index = sparse_index_init()
+                sparse_index_loaded = True
+    return sparse_index
+
+def embedding_cache_stats() -> dict:
+    if isinstance(embeddings, CachedEmbeddings):
+        return embeddings.stats()
+    return {}
\ No newline at end of file
@@ -1,7 +1,21 @@
+import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from model.resource import Resource
-from .init import vectorstore
+from .init import get_vectorstore, get_embeddings, get_sparse_index
 from langchain.docstore.document import Document
-from typing import List, Optional, Union
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
+from config import config as config
+from monitoring.tracing import span
+
+# Embed every sub-query in one forward pass, then query the index concurrently
+batch_queries = config.get_database_config().get('batch_queries', True)
+# How per-query rankings are merged: "rrf" (reciprocal-rank fusion) or "max" (max similarity score)
+fusion_method = config.get_database_config().get('fusion', 'rrf')
+rrf_k = config.get_database_config().get('rrf_k', 60)
+sparse_config = config.get_database_config().get('sparse', {})
+
+executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="similarity_search")
 
 def results_to_model(result:Document) -> Resource:
     return Resource(
@@ -10,7 +24,157 @@ def results_to_model(result:Document) -> Resource:
                 principle   = result.metadata["principle"]
             )
 
-def similarity_search(queries: List[str], k:int = 5) -> tuple[list[Resource], list[Document]]:
-    docs = [vectorstore.similarity_search(subquery, k) for subquery in queries]
-    docs = [doc for doc_sublist in docs for doc in doc_sublist]
-    return docs
+def document_keys(doc: Document) -> List[str]:
+    keys = ["content:" + hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()]
+    if getattr(doc, "id", None):
+        keys.insert(0, "id:" + str(doc.id))
+    return keys
+
+def fuse_results(result_lists: List[List[Tuple[Document, float]]], k: int, method: str = "rrf") -> List[Document]:
+    """
+    Merge the ranked results of several sub-queries into one top-k list.
+
+    Documents are deduplicated by id and by content hash. With "rrf" a document scores sum(1 / (rrf_k + rank))
+    over the lists it appears in, with "max" it keeps its best similarity score.
+    """
+    fused: Dict[str, List] = {}  # canonical key -> [document, score]
+    aliases: Dict[str, str] = {}  # id / content hash -> canonical key
+    for results in result_lists:
+        seen = set()
+        for rank, (doc, score) in enumerate(results):
+            keys = document_keys(doc)
+            key = next((aliases[alias] for alias in keys if alias in aliases), keys[0])
+            for alias in keys:
+                aliases[alias] = key
+            if key in seen:
+                continue
+            seen.add(key)
+            contribution = 1.0 / (rrf_k + rank + 1) if method == "rrf" else score
+            if key not in fused:
+                fused[key] = [doc, contribution]
+            elif method == "rrf":
+                fused[key][1] += contribution
+            else:
+                fused[key][1] = max(fused[key][1], contribution)
+    ranked = sorted(fused.values(), key=lambda entry: entry[1], reverse=True)
+    return [doc for doc, _ in ranked[:k]]
+
+def merge(dense: List[List[Tuple[Document, float]]], sparse: Optional[List[List[Tuple[Document, float]]]], k: int) -> List[Document]:
+    if sparse is None:
+        return fuse_results(dense, k, fusion_method)
+    # BM25 and cosine scores are not comparable, so hybrid results are always merged by rank
+    return fuse_results(dense + sparse, k, "rrf")
+
+def sparse_search(queries: List[str], k: int) -> Optional[List[List[Tuple[Document, float]]]]:
+    """BM25 results of each query, or None without a sparse index."""
+    sparse_index = get_sparse_index()
+    if sparse_index is None:
+        return None
+    return [sparse_index.search(query, k) for query in queries]
+
+def similarity_search(queries: List[str], k:int = 5, batched: Optional[bool] = None, mode: str = "dense") -> List[Document]:
+    """
+    Top-k chunks for the sub-queries, with mode "dense" (vector index), "sparse" (BM25) or "hybrid" (both).
+    Without a sparse index every mode is dense.
+    """
+    sparse = sparse_search(queries, k) if mode != "dense" else None
+    if mode == "sparse" and sparse is not None:
+        return fuse_results(sparse, k, fusion_method)
+    if batched is None:
+        batched = batch_queries
+    vectorstore = get_vectorstore()
+    if batched:
+        vectors = get_embeddings().embed_documents(queries)
+        results = list(executor.map(lambda vector: vectorstore.similarity_search_by_vector_with_score(vector, k), vectors))
+    else:
+        results = [vectorstore.similarity_search_with_score(subquery, k) for subquery in queries]
+    return merge(results, sparse, k)
+
+async def asparse_search(queries: List[str], k: int) -> Optional[List[List[Tuple[Document, float]]]]:
+    # The index is built off the event loop on first use; a search is a few array operations
+    sparse_index = await asyncio.to_thread(get_sparse_index)
+    if sparse_index is None:
+        return None
+    with span("sparse_search"):
+        return [sparse_index.search(query, k) for query in queries]
+
+async def asimilarity_search(queries: List[str], k:int = 5, batched: Optional[bool] = None, mode: str = "dense") -> List[Document]:
+    sparse = await asparse_search(queries, k) if mode != "dense" else None
+    if mode == "sparse" and sparse is not None:
+        return fuse_results(sparse, k, fusion_method)
+    if batched is None:
+        batched = batch_queries
+    # Loading happens off the event loop if the warm-up has not run yet
+    vectorstore = await asyncio.to_thread(get_vectorstore)
+    if batched:
+        with span("embedding"):
+            vectors = await asyncio.to_thread(get_embeddings().embed_documents, queries)
+        with span("vector_search"):
+            results = await asyncio.gather(*[asyncio.to_thread(vectorstore.similarity_search_by_vector_with_score, vector, k) for vector in vectors])
+    else:
+        with span("vector_search"):
+            results = await asyncio.gather(*[vectorstore.asimilarity_search_with_score(subquery, k) for subquery in queries])
+    return merge(results, sparse, k)
+
+async def abatch_similarity_search(queries: List[str], k:int = 5, mode: str = "dense") -> List[List[Document]]:
+    """
+    Top-k chunks of each of many independent queries, unlike `asimilarity_search` which merges its sub-queries into one list.
+    The queries are embedded in one batch, then the index is queried concurrently.
+    """
+    sparse = await asparse_search(queries, k) if mode != "dense" else None
+    if mode == "sparse" and sparse is not None:
+        return [fuse_results([results], k, fusion_method) for results in sparse]
+    vectorstore = await asyncio.to_thread(get_vectorstore)
+    with span("embedding"):
+        vectors = await asyncio.to_thread(get_embeddings().embed_documents, queries)
+    with span("vector_search"):
+        results = await asyncio.gather(*[asyncio.to_thread(vectorstore.similarity_search_by_vector_with_score, vector, k) for vector in vectors])
+    return [merge([dense], None if sparse is None else [sparse[i]], k) for i, dense in enumerate(results)]
+
+async def aconfident_lexical_search(query: str, k:int = 5) -> Optional[List[Document]]:
+    """
+    Hybrid top-k for `query` alone if its best BM25 match is confident (e.g. the query quotes a principle title), else None.
+    Callers use it to skip LLM query expansion.
+    """
+    sparse_index = await asyncio.to_thread(get_sparse_index)
+    if sparse_index is None:
+        return None
+    with span("sparse_search"):
+        lexical, confident = sparse_index.confident_search(query, k, sparse_config.get('confident_score', 0.5),
+                                                           sparse_config.get('confident_ratio', 1.5))
+    if not confident:
+        return None
+    vectorstore = await asyncio.to_thread(get_vectorstore)
+    dense = await asearch_vector_results(vectorstore, query, k)
+    return merge([dense], [lexical], k)
+
+async def asearch_vector_results(vectorstore, query: str, k: int) -> List[Tuple[Document, float]]:
+    with span("embedding"):
+        vector = (await asyncio.to_thread(get_embeddings().embed_documents, [query]))[0]
+    with span("vector_search"):
+        return await asyncio.to_thread(vectorstore.similarity_search_by_vector_with_score, vector, k)
+
+async def apipelined_search(queries: AsyncIterator[str], k:int = 5, mode: str = "dense") -> List[Document]:
+    """
+    Like asimilarity_search, but each query is searched as soon as `queries` yields it,
+    so the retrieval overlaps with the production (e.g. LLM generation) of the next queries.
+    """
+    vectorstore = await asyncio.to_thread(get_vectorstore)
+    sparse_index = await asyncio.to_thread(get_sparse_index) if mode != "dense" else None
+    searches = []
+    sparse = [] if sparse_index is not None else None
+    try:
+        async for query in queries:
+            if sparse is not None:
+                sparse.append(sparse_index.search(query, k))
+                if mode == "sparse":
+                    continue
+            searches.append(asyncio.ensure_future(asearch_vector_results(vectorstore, query, k)))
+        results = await asyncio.gather(*searches)
+    except BaseException:
+        for pending in searches:
+            pending.cancel()
+        raise
+    if mode == "sparse" and sparse is not None:
+        return fuse_results(sparse, k, fusion_method)
+    return merge(list(results), sparse, k)
@@ -0,0 +1,73 @@
+"""
+Rebuild the centroids of the local router / query classifier from the labelled exemplar queries.
+
+Run from the api directory:
+    python -m data.router.build_centroids [--exemplars data/router/exemplars.jsonl] [--output data/router/centroids.json]
+
+Each line of the exemplar file is {"task": "routing" | "category", "label": ..., "text": ...}.
+"""
+import json
+import argparse
+from collections import defaultdict
+from typing import Dict, List
+import numpy as np
+from config import config as config
+from data.pinecone import init as db
+
+
+def unit(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+def leave_one_out(vectors: Dict[str, np.ndarray], min_margin: float):
+    """Accuracy and share of confident predictions, each exemplar classified against centroids built without it."""
+    labels = list(vectors)
+    sums = {label: vectors[label].sum(axis=0) for label in labels}
+    correct = confident = confident_correct = total = 0
+    for truth in labels:
+        for vector in vectors[truth]:
+            centroids = unit(np.stack([sums[label] - vector if label == truth else sums[label] for label in labels]))
+            similarities = np.sort(centroids @ vector)[::-1]
+            predicted = labels[int(np.argmax(centroids @ vector))]
+            total += 1
+            correct += predicted == truth
+            if len(labels) < 2 or similarities[0] - similarities[1] >= min_margin:
+                confident += 1
+                confident_correct += predicted == truth
+    return correct / total, confident / total, confident_correct / max(confident, 1)
+
+
+def main(args):
+    classifier_config = config.get_local_classifier_config()
+    exemplars: Dict[str, Dict[str, List[str]]] = defaultdict(lambda: defaultdict(list))
+    with open(args.exemplars, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                exemplars[record["task"]][record["label"]].append(record["text"])
+
+    embeddings = db.get_embeddings()
+    tasks = {}
+    for task, by_label in exemplars.items():
+        vectors = {label: unit(np.asarray(embeddings.embed_documents(texts), dtype=np.float32)) for label, texts in by_label.items()}
+        labels = sorted(vectors)
+        tasks[task] = {
+            "labels": labels,
+            "counts": [len(vectors[label]) for label in labels],
+            "centroids": [unit(vectors[label].mean(axis=0)).tolist() for label in labels],
+        }
+        min_margin = classifier_config.get('min_margin', {}).get(task, 0.05)
+        accuracy, coverage, confident_accuracy = leave_one_out(vectors, min_margin)
+        print(f"{task}: {dict(zip(labels, tasks[task]['counts']))}, leave-one-out accuracy {accuracy:.2%}, "
+              f"{coverage:.2%} decided locally at margin {min_margin} with accuracy {confident_accuracy:.2%}")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"model": config.get_database_config()['embedding_model'], "tasks": tasks}, f)
+    print(f"Centroids written to {args.output}")
+
+
+if __name__ == "__main__":
+    classifier_config = config.get_local_classifier_config()
+    parser = argparse.ArgumentParser(description="Build the local router / classifier centroids from labelled exemplar queries.")
+    parser.add_argument("--exemplars", default=classifier_config.get('exemplars', 'data/router/exemplars.jsonl'))
+    parser.add_argument("--output", default=classifier_config.get('path', 'data/router/centroids.json'))
+    main(parser.parse_args())
@@ -1,10 +1,28 @@
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 import argparse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from web import search
+from web import admin
+from service import warmup
+from service.adaptive_retrieval import bandit
+from data.pinecone import init as db
+from monitoring import tracing
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm up in the background so the server accepts connections (and /ready) right away
+    warmup_task = asyncio.create_task(warmup.warm_up())
+    yield
+    warmup_task.cancel()
+    # Updates since the last periodic save would otherwise be lost on restart
+    await asyncio.to_thread(bandit.get_bandit().save)
+
+app = FastAPI(lifespan=lifespan)
 
 app.mount("/static", StaticFiles(directory=r"view", html=True), name="static")
 
@@ -16,16 +34,52 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Debug-Timing"],
 )
 
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    trace = tracing.start_trace()
+    response = await call_next(request)
+    # Label by route template, not by the raw path which contains the query
+    endpoint = getattr(request.scope.get("route"), "path", "unmatched")
+    if request.headers.get("X-Debug-Timing"):
+        # Sent with the headers: for streamed responses (SSE, NDJSON) it only covers the work before the first chunk
+        response.headers["X-Debug-Timing"] = trace.header()
+    body_iterator = response.body_iterator
+
+    async def traced_body():
+        # Streamed responses do their work while the body is sent, so the trace ends with the body
+        try:
+            async for chunk in body_iterator:
+                yield chunk
+        finally:
+            tracing.finish_trace(trace, endpoint)
+    response.body_iterator = traced_body()
+    return response
+
 
 
 app.include_router(search.router)
+app.include_router(admin.router)
 
 @app.get("/")
 def get() -> str:
     return "running"
 
+@app.get("/ready")
+def get_ready():
+    status_code = 200 if warmup.is_ready() else 503
+    return JSONResponse(status_code=status_code, content=warmup.status)
+
+@app.get("/metrics")
+def get_metrics() -> Response:
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/metrics/embedding_cache")
+def get_embedding_cache_metrics() -> dict:
+    return db.embedding_cache_stats()
+
 
 if __name__ == "__main__":
     import uvicorn
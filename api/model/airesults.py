@@ -4,4 +4,6 @@ from model.resource import Resource
 
 class AIResults(BaseModel):
     text:str
-    ResourceCollection: list[Resource]
\ No newline at end of file
+    ResourceCollection: list[Resource]
+    # Id to rate the answer with POST /search/feedback, set when the adaptive retrieval strategy was picked by the bandit
+    feedback_id: Optional[str] = None
\ No newline at end of file
@@ -0,0 +1,13 @@
+from pydantic import BaseModel
+from typing import List, Literal, Optional
+
+class BatchRequest(BaseModel):
+    # "resources" only retrieves and reranks, the others answer like their GET /search endpoints
+    pipeline: Literal["resources", "llm", "self_rag", "crag", "adaptive_query"]
+    queries: List[str]
+    # Defaults to the default of the pipeline's GET endpoint
+    k: Optional[int] = None
+    top_k: Optional[int] = None
+    evaluator: Optional[Literal["llm", "cross_encoder"]] = None
+    rerank_mode: bool = True
+    query_category: Literal["Auto", "Factual", "Analytical"] = "Auto"
\ No newline at end of file
@@ -0,0 +1,6 @@
+from pydantic import BaseModel, Field
+
+class Feedback(BaseModel):
+    feedback_id: str
+    # 1 for a helpful answer, 0 for a useless one
+    score: float = Field(ge=0, le=1)
\ No newline at end of file
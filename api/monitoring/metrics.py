@@ -0,0 +1,46 @@
+from prometheus_client import Counter, Histogram
+from prometheus_client.core import CounterMetricFamily, REGISTRY
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+
+request_duration = Histogram("rag_request_duration_seconds", "End-to-end request latency", ["endpoint"], buckets=LATENCY_BUCKETS)
+stage_duration = Histogram("rag_stage_duration_seconds", "Latency of each pipeline stage", ["stage"], buckets=LATENCY_BUCKETS)
+request_llm_calls = Histogram("rag_request_llm_calls", "LLM calls per request", ["endpoint"], buckets=(0, 1, 2, 3, 4, 6, 8, 12, 16, 24))
+request_llm_tokens = Histogram("rag_request_llm_tokens", "LLM tokens per request", ["endpoint"],
+                               buckets=(0, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000))
+llm_calls = Counter("rag_llm_calls_total", "LLM calls", ["model"])
+llm_tokens = Counter("rag_llm_tokens_total", "LLM tokens", ["model", "type"])
+context_tokens = Counter("rag_context_tokens_total", "Estimated context tokens before and after context packing", ["stage"])
+coalesced_requests = Counter("rag_coalesced_requests_total", "Answered requests that computed their answer (leader) or shared a concurrent one (follower)",
+                             ["endpoint", "role"])
+web_searches = Counter("rag_web_searches_total", "CRAG web searches by outcome: cache_hit, provider, timeout, error or unavailable", ["outcome"])
+strategy_selections = Counter("rag_strategy_selections_total", "Adaptive retrieval strategies picked by the bandit", ["category", "strategy"])
+strategy_reward = Histogram("rag_strategy_reward", "Rewards of the adaptive retrieval strategies", ["category", "strategy"],
+                            buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1))
+rerank_batch_size = Histogram("rag_rerank_batch_size", "Pairs per cross-encoder batch", buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+rerank_queue_wait = Histogram("rag_rerank_queue_wait_seconds", "Time a rerank request waited for its batch",
+                              buckets=(0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25))
+local_classifier_decisions = Counter("rag_local_classifier_decisions_total", "Routing and classification decisions, made locally or escalated to the LLM",
+                                     ["task", "outcome"])
+
+
+class ServiceStatsCollector:
+    """
+    Exposes the stats kept by the embedding cache in Prometheus format.
+    """
+    def describe(self):
+        # Without describe() the registry calls collect() at registration, before the services are importable
+        return []
+
+    def collect(self):
+        from data.pinecone import init as db
+
+        cache_stats = db.embedding_cache_stats()
+        if cache_stats:
+            hits = CounterMetricFamily("rag_embedding_cache_lookups", "Embedding cache lookups by result", labels=["result"])
+            for result in ("memory_hits", "disk_hits", "misses"):
+                hits.add_metric([result], cache_stats[result])
+            yield hits
+
+
+REGISTRY.register(ServiceStatsCollector())
@@ -0,0 +1,97 @@
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from . import metrics as metrics
+
+
+class Trace:
+    """
+    Per-request record of stage timings and LLM usage.
+    Shared by every task and worker thread spawned for the request, hence the lock.
+    """
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans: List[Tuple[str, float]] = []
+        self.llm_calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self._lock = threading.Lock()
+
+    def add_span(self, name: str, duration: float):
+        with self._lock:
+            self.spans.append((name, duration))
+
+    def add_llm_call(self, input_tokens: int, output_tokens: int):
+        with self._lock:
+            self.llm_calls += 1
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+
+    @property
+    def tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def header(self) -> str:
+        """Per-stage breakdown for the X-Debug-Timing response header, in Server-Timing syntax."""
+        with self._lock:
+            stages = [f"{name};dur={duration * 1000:.1f}" for name, duration in self.spans]
+        stages.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        stages.append(f"llm_calls;count={self.llm_calls}")
+        stages.append(f"llm_tokens;input={self.input_tokens};output={self.output_tokens}")
+        return ", ".join(stages)
+
+
+current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+def start_trace() -> Trace:
+    trace = Trace()
+    current_trace.set(trace)
+    return trace
+
+def finish_trace(trace: Trace, endpoint: str):
+    metrics.request_duration.labels(endpoint).observe(trace.elapsed())
+    metrics.request_llm_calls.labels(endpoint).observe(trace.llm_calls)
+    metrics.request_llm_tokens.labels(endpoint).observe(trace.tokens)
+
+
+@contextmanager
+def span(name: str):
+    """Time a pipeline stage, in the current request trace and in the stage histogram."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        metrics.stage_duration.labels(name).observe(duration)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add_span(name, duration)
+
+
+class LLMTracingCallback(BaseCallbackHandler):
+    """Counts LLM calls and token usage, per model and in the current request trace."""
+    run_inline = True
+
+    def __init__(self, model: str):
+        self.model = model
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        input_tokens = output_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                input_tokens += usage.get("input_tokens", 0)
+                output_tokens += usage.get("output_tokens", 0)
+        metrics.llm_calls.labels(self.model).inc()
+        metrics.llm_tokens.labels(self.model, "input").inc(input_tokens)
+        metrics.llm_tokens.labels(self.model, "output").inc(output_tokens)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add_llm_call(input_tokens, output_tokens)
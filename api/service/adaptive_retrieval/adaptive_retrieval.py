@@ -1,4 +1,9 @@
 from .utils import *
+from service import local_classifier as local_classifier
+from service.context_packing import pack_context
+from .bandit import Pull, bandit_config, get_bandit, sigmoid
+from service.llm import lazy
+from typing import Optional
 
 class categories_options(BaseModel):
         category: str = Field(description="The category of the query, the options are: Factual, Analytical", example="Factual")
@@ -6,7 +11,7 @@ class categories_options(BaseModel):
 
 class QueryClassifier:
     def __init__(self):
-        self.llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash-latest", temperature=0.8, top_p=0.5)
+        self.llm = llm_profile("query_classifier")
         self.prompt = PromptTemplate(
             input_variables=["query"],
             template="Classify the following query into one of these categories: Factual, Analytical.\nQuery: {query}\nCategory:"
@@ -14,9 +19,14 @@ class QueryClassifier:
         self.chain = self.prompt | self.llm.with_structured_output(categories_options)
 
 
-    def classify(self, query):
+    async def classify(self, query):
         print("clasiffying query")
-        return self.chain.invoke(query).category
+        with span("classify_local"):
+            category = await local_classifier.classify("category", query)
+        if category is not None:
+            return category
+        with span("classify"):
+            return (await self.chain.ainvoke(query)).category
 
 """
 Define BaseRetrievalStrategy
@@ -25,17 +35,17 @@ Define BaseRetrievalStrategy
 class BaseRetrievalStrategy:
     def __init__(self):
         self.search_engine = search
-        self.llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash-latest", temperature=0.8, top_p=0.5)
+        self.llm = llm_profile("query_expansion")
 
 
-    def retrieve(self, query, k=4):
-        return self.search_engine.similarity_search(query, k=k)
+    async def retrieve(self, query, k=4):
+        return await self.search_engine.asimilarity_search(query, k=k)
 
 
 
    
 class FactualRetrievalStrategy(BaseRetrievalStrategy):
-    def retrieve(self, query, k=4):
+    async def retrieve(self, query, k=4):
         print("retrieving factual")
         # Use LLM to enhance the query
         enhanced_query_prompt = PromptTemplate(
@@ -43,11 +53,11 @@ class FactualRetrievalStrategy(BaseRetrievalStrategy):
             template="Enhance this factual query for better information retrieval: {query}"
         )
         query_chain = enhanced_query_prompt | self.llm
-        enhanced_query = query_chain.invoke(query).content
+        enhanced_query = (await query_chain.ainvoke(query)).content
         print(f'enhande query: {enhanced_query}')
 
         # Retrieve documents using the enhanced query
-        docs = self.search_engine.similarity_search([enhanced_query], k=k)
+        docs = await self.search_engine.asimilarity_search([enhanced_query], k=k)
         return [doc for doc in docs]
 
 
@@ -61,26 +71,25 @@ class multiple_queries(BaseModel):
     query2: str  = Field(description="query 2")
     query3: str  = Field(description="query 3")
 
-def get_generated_queries(query, k_queries = 3):
-    # RAG-Fusion: Related
-    template = """You are a helpful assistant that generates multiple search queries based on a single input query. \n
+# RAG-Fusion: Related
+rag_fusion_template = """You are a helpful assistant that generates multiple search queries based on a single input query. \n
     Generate multiple search queries related to: {question} \n
     Output (3 queries):"""
-    prompt_rag_fusion = ChatPromptTemplate.from_template(template)
-    llm = ChatGoogleGenerativeAI(model="gemini-1.5-pro-latest", temperature=0.8, top_p=0.5)
-    structured_llm = llm.with_structured_output(multiple_queries)
-    generate_queries = (
-        prompt_rag_fusion 
-        | structured_llm
-    )
-    result = generate_queries.invoke({"question" : query})
+# Built on first use and shared by every request
+get_rag_fusion_chain = lazy(lambda: (
+    ChatPromptTemplate.from_template(rag_fusion_template)
+    | llm_profile("rag_fusion").with_structured_output(multiple_queries)
+))
+
+async def get_generated_queries(query, k_queries = 3):
+    result = await get_rag_fusion_chain().ainvoke({"question" : query})
     return [result.query1,result.query2,result.query3]
     
 class AnalyticalRetrievalStrategy(BaseRetrievalStrategy):
-    def retrieve(self, query, k=4):
-        queries = get_generated_queries(query)
+    async def retrieve(self, query, k=4):
+        queries = await get_generated_queries(query)
         print("Generated_queries : ", queries)
-        docs = self.search_engine.similarity_search(queries, k=k)
+        docs = await self.search_engine.asimilarity_search(queries, k=k)
         return docs
     
 
@@ -118,26 +127,48 @@ class AdaptiveRetriever:
         # }
 
 
-    def get_relevant_documents(self, query: str, k:int = 3, mode: str = "Auto") -> List[Document]:
+    async def retrieve(self, query: str, k:int = 3, mode: str = "Auto") -> Tuple[List[Document], Optional[Pull]]:
+        """
+        Retrieve with the strategy picked for the query category, and the pull to report to the strategy bandit
+        once the answer is generated (None when no strategy was picked by the bandit).
+        An explicit `mode` always gets its strategy; only "Auto" may be answered by a confident lexical match instead.
+        """
+        if mode == "Auto" and adaptive_retrieval_config.get('skip_expansion_when_confident', False):
+            docs = await search.aconfident_lexical_search(query, k)
+            if docs is not None:
+                print("Confident lexical match, skipping query expansion")
+                return docs, None
         if mode == "Auto" or mode not in ['Factual', 'Analytical', 'Auto']:
-            category = self.classifier.classify(query)
+            category = await self.classifier.classify(query)
         else:
             category = mode
         print("Using : ", category)
         strategy = self.strategies[category]
-        retriever = random_retriever(strategy)
-        return retriever.retrieve(query, k)
+        if not bandit_config.get('enabled', False):
+            return await random_retriever(strategy).retrieve(query, k), None
+        retrievers = dict(strategy)
+        name = get_bandit().choose(category, list(retrievers))
+        print("Using ", name)
+        pull = Pull(category, name)
+        return await retrievers[name].retrieve(query, k), pull
+
+    async def get_relevant_documents(self, query: str, k:int = 3, mode: str = "Auto") -> List[Document]:
+        docs, _ = await self.retrieve(query, k, mode)
+        return docs
     
 # Define aditional retriever that inherits from langchain BaseRetriever
 class PydanticAdaptiveRetriever():
     def __init__(self, adaptive_retriever):
         self.adaptive_retriever: AdaptiveRetriever = adaptive_retriever
 
-    def get_relevant_documents(self, query: str, k:int = 3, mode: str = "Auto") -> List[Document]:
-        return self.adaptive_retriever.get_relevant_documents(query, k, mode)
+    async def retrieve(self, query: str, k:int = 3, mode: str = "Auto") -> Tuple[List[Document], Optional[Pull]]:
+        return await self.adaptive_retriever.retrieve(query, k, mode)
+
+    async def get_relevant_documents(self, query: str, k:int = 3, mode: str = "Auto") -> List[Document]:
+        return await self.adaptive_retriever.get_relevant_documents(query, k, mode)
 
     async def aget_relevant_documents(self, query: str) -> List[Document]:
-        return self.get_relevant_documents(query)
+        return await self.get_relevant_documents(query)
     
     
 # Define the Adaptive RAG class  
@@ -153,7 +184,7 @@ class AdaptiveRAG:
     def __init__(self):
         adaptive_retriever = AdaptiveRetriever()
         self.retriever = PydanticAdaptiveRetriever(adaptive_retriever=adaptive_retriever)
-        self.llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash-latest", temperature=0.8, top_p=0.5)
+        self.llm = llm_profile("adaptive_generation")
         
         # Create a custom prompt
         prompt_template = """Use the following pieces of context to answer the question at the end. 
@@ -168,12 +199,39 @@ class AdaptiveRAG:
         # Create the LLM chain
         self.llm_chain = prompt | self.llm | StrOutputParser()
         
-    def answer(self, query: str, k:int = 3, rerank_mode : bool = True, query_category: str = "Auto") -> str:
-        docs = self.retriever.get_relevant_documents(query, k, query_category)
+    async def prepare(self, query: str, k:int = 3, rerank_mode : bool = True, query_category: str = "Auto"):
+        docs, pull = await self.retriever.retrieve(query, k, query_category)
         print("Num docs : ", len(docs))
         if rerank_mode:
-            docs = rerank.reranking_relevant_documents(query, docs)
+            scored_docs = await rerank.arerank_with_scores(query, docs)
+            docs = [doc for doc, _ in scored_docs]
+            if pull is not None and scored_docs:
+                pull.quality = sigmoid(scored_docs[0][1])
         resources = [results_to_model(doc) for doc in docs]
         # print(docs)
-        input_data = {"context": "\n".join([doc.page_content for doc in docs]), "question": query}
-        return self.llm_chain.invoke(input_data), resources
\ No newline at end of file
+        input_data = {"context": pack_context([doc.page_content for doc in docs], "adaptive_generation"), "question": query}
+        return input_data, resources, pull
+
+    async def answer(self, query: str, k:int = 3, rerank_mode : bool = True, query_category: str = "Auto"):
+        """
+        Return the response, its resources and the feedback id of the retrieval strategy used (None without one).
+        """
+        input_data, resources, pull = await self.prepare(query, k, rerank_mode, query_category)
+        with span("generation"):
+            response = await self.llm_chain.ainvoke(input_data)
+        feedback_id = get_bandit().complete(pull) if pull is not None else None
+        return response, resources, feedback_id
+
+    async def astream_answer(self, query: str, k:int = 3, rerank_mode : bool = True, query_category: str = "Auto"):
+        """
+        Retrieve and rerank, then return the resources together with an async iterator over the generated tokens.
+        A feedback id is yielded as ("feedback", id) after the last token when a retrieval strategy was picked by the bandit.
+        """
+        input_data, resources, pull = await self.prepare(query, k, rerank_mode, query_category)
+
+        async def tokens():
+            async for token in self.llm_chain.astream(input_data):
+                yield "token", token
+            if pull is not None:
+                yield "feedback", get_bandit().complete(pull)
+        return resources, tokens()
\ No newline at end of file
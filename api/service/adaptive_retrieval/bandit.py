@@ -0,0 +1,184 @@
+import os
+import json
+import math
+import time
+import uuid
+import random
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from config import config as config
+from monitoring import metrics as metrics
+from monitoring.tracing import current_trace
+from service.llm import lazy
+
+bandit_config = config.get_strategy_bandit_config()
+
+
+@dataclass
+class Pull:
+    """One use of a retrieval strategy, measured from the start of retrieval to the end of generation."""
+    category: str
+    strategy: str
+    start: float = field(default_factory=time.perf_counter)
+    llm_calls_at_start: Optional[int] = None
+    latency: Optional[float] = None
+    llm_calls: Optional[int] = None
+    # Sigmoid of the top rerank score, or the user feedback
+    quality: Optional[float] = None
+
+    def __post_init__(self):
+        trace = current_trace.get()
+        if trace is not None and self.llm_calls_at_start is None:
+            self.llm_calls_at_start = trace.llm_calls
+
+    def finish(self):
+        self.latency = time.perf_counter() - self.start
+        trace = current_trace.get()
+        if trace is not None and self.llm_calls_at_start is not None:
+            self.llm_calls = trace.llm_calls - self.llm_calls_at_start
+
+
+def sigmoid(x: float) -> float:
+    return 1 / (1 + math.exp(-x))
+
+def reward(pull: Pull) -> Optional[float]:
+    """
+    Weighted mean of the quality, latency and LLM call scores of `pull`, each in [0, 1].
+    Latency and LLM calls score 0.5 at their target and tend to 1 as they shrink.
+    Without a quality signal there is no reward, the pull waits for feedback.
+    """
+    if pull.quality is None:
+        return None
+    weights = bandit_config.get('reward_weights', {})
+    terms = [(weights.get('quality', 0.6), pull.quality)]
+    if pull.latency is not None:
+        terms.append((weights.get('latency', 0.25), 1 / (1 + pull.latency / bandit_config.get('latency_target_s', 3.0))))
+    if pull.llm_calls is not None:
+        terms.append((weights.get('llm_calls', 0.15), 1 / (1 + pull.llm_calls / bandit_config.get('llm_calls_target', 3))))
+    return sum(weight * score for weight, score in terms) / sum(weight for weight, _ in terms)
+
+
+class StrategyBandit:
+    """
+    Thompson sampling over the retrieval strategies of each query category.
+    Every (category, strategy) arm keeps a Beta posterior over its reward in [0, 1], updated with fractional
+    successes (alpha += reward, beta += 1 - reward). The arms of a category are discounted by `decay` at each
+    of its updates, so the choice follows strategies whose latency or quality drifts.
+    The posteriors are saved to `path` at most every `save_interval_s` seconds, from a worker thread so the event loop
+    never waits on the disk, and reloaded at startup.
+    The state belongs to one process: with several workers each one learns from its own requests only and
+    the last to save overwrites the others, so run the API with a single worker when the bandit is enabled.
+    """
+    def __init__(self, path: Optional[str] = None, decay: float = 0.995, save_interval_s: float = 10,
+                 max_pending: int = 10000):
+        self.path = path
+        self.decay = decay
+        self.save_interval_s = save_interval_s
+        self.max_pending = max_pending
+        self.arms: Dict[str, Dict[str, List[float]]] = {}
+        # Pulls waiting for user feedback, by feedback id
+        self.pending: "OrderedDict[str, Pull]" = OrderedDict()
+        self.last_save = float("-inf")
+        self.dirty = False
+        # Snapshots are numbered so a slow write never overwrites a newer one
+        self.version = 0
+        self.written_version = 0
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as file:
+                self.arms = json.load(file).get("arms", {})
+            print(f"Strategy bandit state loaded from {path}")
+
+    def choose(self, category: str, strategies: List[str]) -> str:
+        with self._lock:
+            arms = self.arms.setdefault(category, {})
+            samples = {name: random.betavariate(*arms.setdefault(name, [1.0, 1.0])) for name in strategies}
+        strategy = max(samples, key=samples.get)
+        metrics.strategy_selections.labels(category, strategy).inc()
+        return strategy
+
+    def update(self, category: str, strategy: str, value: float, weight: float = 1.0):
+        with self._lock:
+            arms = self.arms.setdefault(category, {})
+            for posterior in arms.values():
+                posterior[0] = 1 + (posterior[0] - 1) * self.decay
+                posterior[1] = 1 + (posterior[1] - 1) * self.decay
+            posterior = arms.setdefault(strategy, [1.0, 1.0])
+            posterior[0] += weight * value
+            posterior[1] += weight * (1 - value)
+            self.dirty = True
+        metrics.strategy_reward.labels(category, strategy).observe(value)
+        snapshot = self.snapshot(force=False)
+        if snapshot is not None:
+            threading.Thread(target=self.write, args=snapshot, name="strategy-bandit-save", daemon=True).start()
+
+    def complete(self, pull: Pull) -> str:
+        """Record a finished pull and return the feedback id under which it waits for user feedback."""
+        pull.finish()
+        value = reward(pull)
+        if value is not None:
+            self.update(pull.category, pull.strategy, value)
+        feedback_id = uuid.uuid4().hex
+        with self._lock:
+            self.pending[feedback_id] = pull
+            while len(self.pending) > self.max_pending:
+                self.pending.popitem(last=False)
+        print(f"Strategy {pull.strategy} ({pull.category}): {pull.latency:.2f}s, {pull.llm_calls} LLM calls, "
+              f"quality {pull.quality if pull.quality is None else round(pull.quality, 3)}, reward {value if value is None else round(value, 3)}")
+        return feedback_id
+
+    def feedback(self, feedback_id: str, score: float) -> Optional[Pull]:
+        """
+        Reward the pull of `feedback_id` again with the user's score in [0, 1] as its quality,
+        weighted `feedback_weight` times a rerank-based reward. None if the id is unknown or expired.
+        """
+        with self._lock:
+            pull = self.pending.pop(feedback_id, None)
+        if pull is None:
+            return None
+        pull.quality = score
+        self.update(pull.category, pull.strategy, reward(pull), bandit_config.get('feedback_weight', 2.0))
+        return pull
+
+    def snapshot(self, force: bool) -> Optional[Tuple[int, str]]:
+        """The numbered state to write if a save is due, None otherwise."""
+        with self._lock:
+            # A forced save also covers a snapshot still being written by a worker thread
+            pending = self.dirty or (force and self.version > self.written_version)
+            if not self.path or not pending or (not force and time.monotonic() - self.last_save < self.save_interval_s):
+                return None
+            self.dirty = False
+            self.last_save = time.monotonic()
+            self.version += 1
+            return self.version, json.dumps({"arms": self.arms})
+
+    def write(self, version: int, data: str):
+        """Atomically replace the saved state with snapshot `version`, unless a newer one is already written."""
+        with self._write_lock:
+            if version <= self.written_version:
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path + ".tmp", "w", encoding="utf-8") as file:
+                file.write(data)
+            os.replace(self.path + ".tmp", self.path)
+            self.written_version = version
+
+    def save(self, force: bool = True):
+        """Write the state now, on the calling thread."""
+        snapshot = self.snapshot(force)
+        if snapshot is not None:
+            self.write(*snapshot)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {category: {name: {"alpha": round(alpha, 3), "beta": round(beta, 3), "mean": round(alpha / (alpha + beta), 3)}
+                               for name, (alpha, beta) in arms.items()}
+                    for category, arms in self.arms.items()}
+
+
+get_bandit = lazy(lambda: StrategyBandit(bandit_config.get('path'), decay=bandit_config.get('decay', 0.995),
+                                         save_interval_s=bandit_config.get('save_interval_s', 10),
+                                         max_pending=bandit_config.get('max_pending_feedback', 10000)))
@@ -1,27 +1,37 @@
+import re
 
 from langchain.prompts import ChatPromptTemplate, PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from langchain_google_genai import ChatGoogleGenerativeAI
+from service.llm import llm_profile
 from langchain_core.pydantic_v1 import BaseModel, Field
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, AsyncIterator
 from langchain.docstore.document import Document
 from config import config as config
 from data.pinecone import search as search
 from langchain_core.retrievers import BaseRetriever
 from service import rerank as rerank  
 from model.resource import Resource
+from monitoring.tracing import span
 
 
 """
 Define BaseRetrievalStrategy
 """
 
+adaptive_retrieval_config = config.get_adaptive_retrieval_config()
+
 class BaseRetrievalStrategy:
     def __init__(self):
-        self.llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash-latest", temperature=0.8, top_p=0.5)
+        self.llm = llm_profile("query_expansion")
+
+    @property
+    def mode(self) -> str:
+        """Retrieval mode of this strategy: "dense", "sparse" or "hybrid"."""
+        modes = adaptive_retrieval_config.get('retrieval_modes', {})
+        return modes.get(type(self).__name__, modes.get('default', 'dense'))
 
-    def retrieve(self, query, k=4):
-        return search.similarity_search(query, k=k)
+    async def retrieve(self, query, k=4):
+        return await search.asimilarity_search(query, k=k, mode=self.mode)
 
 """
 Define AnalyticalRetrievalStrategy
@@ -29,7 +39,22 @@ Define AnalyticalRetrievalStrategy
 
 class RewritingRetriever(BaseRetrievalStrategy):
     def __init__(self):
-        self.llm = ChatGoogleGenerativeAI(model="gemini-1.0-pro-latest", temperature=0.8, top_p=0.5)
+        self.llm = llm_profile("query_rewrite")
+        # Create a prompt template for query rewriting
+        query_rewrite_template = """You are an AI assistant tasked with reformulating user queries to improve retrieval in a RAG system. 
+        Given the original query, rewrite it to be more specific, detailed, and likely to retrieve relevant information.
+
+        Original query: {original_query}
+
+        Rewritten query:"""
+
+        query_rewrite_prompt = PromptTemplate(
+            input_variables=["original_query"],
+            template=query_rewrite_template
+        )
+
+        # Create an LLMChain for query rewriting
+        self.query_rewriter = query_rewrite_prompt | self.llm
     
     # # Use LLM to enhance the query
     #     enhanced_query_prompt = PromptTemplate(
@@ -40,7 +65,7 @@ class RewritingRetriever(BaseRetrievalStrategy):
     #     enhanced_query = query_chain.invoke(query).content
     #     print(f'enhande query: {enhanced_query}') 
     
-    def rewrite_query(self, original_query):
+    async def rewrite_query(self, original_query):
         """
         Rewrite the original query to improve retrieval.
         
@@ -50,35 +75,18 @@ class RewritingRetriever(BaseRetrievalStrategy):
         Returns:
         str: The rewritten query
         """
-        # Create a prompt template for query rewriting
-        query_rewrite_template = """You are an AI assistant tasked with reformulating user queries to improve retrieval in a RAG system. 
-        Given the original query, rewrite it to be more specific, detailed, and likely to retrieve relevant information.
-
-        Original query: {original_query}
-
-        Rewritten query:"""
-
-        query_rewrite_prompt = PromptTemplate(
-            input_variables=["original_query"],
-            template=query_rewrite_template
-        )
-
-        # Create an LLMChain for query rewriting
-        query_rewriter = query_rewrite_prompt | self.llm
-
-        response = query_rewriter.invoke(original_query)
+        with span("rewrite_query"):
+            response = await self.query_rewriter.ainvoke(original_query)
         return response.content
 
-    def retrieve(self, query, k):
-        rewritten_query  = self.rewrite_query(query)
-        docs = search.similarity_search([rewritten_query], k=k)
+    async def retrieve(self, query, k):
+        rewritten_query  = await self.rewrite_query(query)
+        docs = await search.asimilarity_search([rewritten_query], k=k, mode=self.mode)
         return docs
 
 class StepBackRetriever(BaseRetrievalStrategy):
     def __init__(self):
-        self.llm = ChatGoogleGenerativeAI(model="gemini-1.0-pro-latest", temperature=0.8, top_p=0.5)
-        
-    def step_back_prompt(self, query :str):
+        self.llm = llm_profile("query_rewrite")
         # Create a prompt template for step-back prompting
         step_back_template = """You are an AI assistant tasked with generating broader, more general queries to improve context retrieval in a RAG system.
         Given the original query, generate a step-back query that is more general and can help retrieve relevant background information.
@@ -92,9 +100,12 @@ class StepBackRetriever(BaseRetrievalStrategy):
             template=step_back_template
         )
         # Create an LLMChain for step-back prompting
-        step_back_chain = step_back_prompt | self.llm
+        self.step_back_chain = step_back_prompt | self.llm
         
-        def generate_step_back_query(original_query):
+    async def step_back_prompt(self, query :str):
+        step_back_chain = self.step_back_chain
+        
+        async def generate_step_back_query(original_query):
             """
             Generate a step-back query to retrieve broader context.
             
@@ -104,34 +115,37 @@ class StepBackRetriever(BaseRetrievalStrategy):
             Returns:
             str: The step-back query
             """
-            response = step_back_chain.invoke(original_query)
+            with span("step_back_query"):
+                response = await step_back_chain.ainvoke(original_query)
             return response.content
         
-        return generate_step_back_query(query)
+        return await generate_step_back_query(query)
 
-    def retrieve(self, query, k):
-        step_back_query = self.step_back_prompt(query)
-        docs = search.similarity_search([query, step_back_query], k=k)
+    async def retrieve(self, query, k):
+        step_back_query = await self.step_back_prompt(query)
+        docs = await search.asimilarity_search([query, step_back_query], k=k, mode=self.mode)
         return docs
 
 class HyDERetriever(BaseRetrievalStrategy):
     def __init__(self, chunk_size=500):
-        self.llm = ChatGoogleGenerativeAI(model="gemini-1.0-pro-latest", temperature=0.8, top_p=0.5)
+        self.llm = llm_profile("query_rewrite")
         self.chunk_size = chunk_size
-        
-    def generate_hypothetical_document(self, query):
         hyde_prompt = PromptTemplate(
             input_variables=["query", "chunk_size"],
             template="""Given the question '{query}', generate a hypothetical document that directly answers this question. The document should be detailed and in-depth.
             the document size has be exactly {chunk_size} characters.""",
         )
-        hyde_chain = hyde_prompt | self.llm
+        self.hyde_chain = hyde_prompt | self.llm
+        
+    async def generate_hypothetical_document(self, query):
+        hyde_chain = self.hyde_chain
         input_variables = {"query": query, "chunk_size": self.chunk_size}
-        return hyde_chain.invoke(input_variables).content
+        with span("hyde_document"):
+            return (await hyde_chain.ainvoke(input_variables)).content
 
-    def retrieve(self, query, k=3):
-        hypothetical_doc = self.generate_hypothetical_document(query)
-        docs = search.similarity_search([query, hypothetical_doc], k=k)
+    async def retrieve(self, query, k=3):
+        hypothetical_doc = await self.generate_hypothetical_document(query)
+        docs = await search.asimilarity_search([query, hypothetical_doc], k=k, mode=self.mode)
         return docs
     
     
@@ -145,36 +159,100 @@ class multiple_queries(BaseModel):
     query2: str  = Field(description="query 2")
     query3: str  = Field(description="query 3")
 
-class FusionRetriever(BaseRetrievalStrategy):
+query_lines_instruction = """
+        Output exactly {num_queries} queries, one per line, without numbering or any other text."""
+
+def clean_query_line(line: str) -> str:
+    # Drop list markers ("1.", "2)", "-", "*") and quotes the model may add anyway
+    query = re.sub(r"^\s*(?:[-*\u2022]|\d+[.)])\s*", "", line).strip().strip('"')
+    return "" if query.endswith(":") else query
+
+async def stream_query_lines(chain, input_data: Dict[str, Any], max_queries: int) -> AsyncIterator[str]:
+    """
+    Yield the first `max_queries` queries generated by `chain` (one per line) as soon as each line is complete.
+    The stream is always read to the end, so the call is completed and its usage reported to the callbacks.
+    """
+    buffer = ""
+    count = 0
+    async for chunk in chain.astream(input_data):
+        buffer += chunk
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            query = clean_query_line(line)
+            if query and count < max_queries:
+                count += 1
+                yield query
+    query = clean_query_line(buffer)
+    if query and count < max_queries:
+        yield query
+
+class QueryExpansionRetriever(BaseRetrievalStrategy):
+    """
+    Retrieves with several LLM-generated queries. In pipelined mode the queries are streamed one per line and
+    each one is searched as soon as it is complete, overlapping generation with retrieval.
+    Subclasses set the structured chain, the streaming chain, the prompt input key and the span name.
+    """
+    input_key = "question"
+    span_name = "query_expansion"
+
+    async def get_generated_queries(self, query, k_queries = 3):
+        with span(self.span_name):
+            result = await self.generate_queries.ainvoke({self.input_key : query})
+        return [result.query1,result.query2,result.query3]
+
+    async def pipelined_retrieve(self, query, k=4):
+        queries = []
+
+        async def generated_queries():
+            with span(self.span_name):
+                async for generated in stream_query_lines(self.stream_queries,
+                                                          {self.input_key: query, "num_queries": adaptive_retrieval_config.get('num_queries', 3)},
+                                                          adaptive_retrieval_config.get('num_queries', 3)):
+                    queries.append(generated)
+                    yield generated
+            if not queries:
+                # Nothing usable was generated, search with the original query
+                queries.append(query)
+                yield query
+
+        docs = await search.apipelined_search(generated_queries(), k=k, mode=self.mode)
+        print("Generated queries : ", queries)
+        return docs
+
+    async def retrieve(self, query, k=4):
+        if adaptive_retrieval_config.get('pipelined_queries', False):
+            return await self.pipelined_retrieve(query, k)
+        queries = await self.get_generated_queries(query)
+        print("Generated queries : ", queries)
+        docs = await search.asimilarity_search(queries, k=k, mode=self.mode)
+        return docs
+
+class FusionRetriever(QueryExpansionRetriever):
+    input_key = "question"
+    span_name = "fusion_queries"
+
     def __init__(self):
-        self.llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash-latest", temperature=0.8, top_p=0.5)
-        
-        
-    def get_generated_queries(self, query, k_queries = 3):
+        self.llm = llm_profile("query_expansion")
         # RAG-Fusion: Related
         template = """You are a helpful assistant that generates multiple search queries based on a single input query. \n
         Generate multiple search queries related to: {question} \n
         Output (3 queries):"""
         prompt_rag_fusion = ChatPromptTemplate.from_template(template)
         structured_llm = self.llm.with_structured_output(multiple_queries)
-        generate_queries = (
+        self.generate_queries = (
             prompt_rag_fusion 
             | structured_llm
         )
-        result = generate_queries.invoke({"question" : query})
-        return [result.query1,result.query2,result.query3]
-    
-    def retrieve(self, query, k=4):
-        queries = self.get_generated_queries(query)
-        print("Generated_queries : ", queries)
-        docs = search.similarity_search(queries, k=k)
-        return docs
+        stream_template = """You are a helpful assistant that generates multiple search queries based on a single input query. \n
+        Generate multiple search queries related to: {question} \n""" + query_lines_instruction
+        self.stream_queries = ChatPromptTemplate.from_template(stream_template) | self.llm | StrOutputParser()
     
-class SubQueryDecompositionRetriever(BaseRetrievalStrategy):
+class SubQueryDecompositionRetriever(QueryExpansionRetriever):
+    input_key = "original_query"
+    span_name = "sub_queries"
+
     def __init__(self):
-        self.llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash-latest", temperature=0.8, top_p=0.5)
-        
-    def get_generated_queries(self, query, k_queries = 3):
+        self.llm = llm_profile("query_expansion")
         # Create a prompt template for sub-query decomposition
         subquery_decomposition_template = """You are an AI assistant tasked with breaking down complex queries into simpler sub-queries for a RAG system.
         Given the original query, decompose it into 3 simpler sub-queries that, when answered together, would provide a comprehensive response to the original query.
@@ -202,12 +280,10 @@ class SubQueryDecompositionRetriever(BaseRetrievalStrategy):
         )
         structured_llm = self.llm.with_structured_output(multiple_queries)
         # Create an LLMChain for sub-query decomposition
-        subquery_decomposer_chain = (subquery_decomposition_prompt | structured_llm)
-        result = subquery_decomposer_chain.invoke({"original_query" : query})
-        return [result.query1,result.query2,result.query3]
-    
-    def retrieve(self, query, k=4):
-        queries = self.get_generated_queries(query)
-        print("Generated sub-queries : ", queries)
-        docs = search.similarity_search(queries, k=k)
-        return docs
\ No newline at end of file
+        self.generate_queries = (subquery_decomposition_prompt | structured_llm)
+        stream_template = """You are an AI assistant tasked with breaking down complex queries into simpler sub-queries for a RAG system.
+        Given the original query, decompose it into {num_queries} simpler sub-queries that, when answered together, would provide a comprehensive response to the original query.
+        
+        Original query: {original_query}
+        """ + query_lines_instruction
+        self.stream_queries = PromptTemplate(input_variables=["original_query", "num_queries"], template=stream_template) | self.llm | StrOutputParser()
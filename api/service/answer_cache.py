@@ -0,0 +1,102 @@
+import time
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+from model.airesults import AIResults
+
+Scope = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def make_scope(endpoint: str, params: Dict[str, Any]) -> Scope:
+    return endpoint, tuple(sorted((name, str(value)) for name, value in params.items()))
+
+
+class CacheEntry:
+    def __init__(self, scope: Scope, query: str, vector: np.ndarray, result: AIResults):
+        self.scope = scope
+        self.query = query
+        self.vector = vector
+        self.result = result
+        self.created = time.monotonic()
+
+
+class SemanticAnswerCache:
+    """
+    AIResults cache looked up by query embedding: a hit is a previously answered query of the same scope
+    (endpoint and parameters) whose cosine similarity is at least `similarity_threshold`.
+    Entries expire after `ttl_seconds` and the least recently used ones are evicted beyond `max_entries`.
+    """
+    def __init__(self, similarity_threshold: float = 0.95, ttl_seconds: float = 3600, max_entries: int = 1024):
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[int, CacheEntry]" = OrderedDict()
+        self.scopes: Dict[Scope, set] = {}
+        self.next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(vector: List[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def _remove(self, entry_id: int):
+        entry = self.entries.pop(entry_id)
+        ids = self.scopes[entry.scope]
+        ids.discard(entry_id)
+        if not ids:
+            del self.scopes[entry.scope]
+
+    def _expired(self, entry: CacheEntry, now: float) -> bool:
+        return now - entry.created > self.ttl_seconds
+
+    def lookup(self, scope: Scope, vector: List[float]) -> Optional[AIResults]:
+        query_vector = self.normalize(vector)
+        now = time.monotonic()
+        with self._lock:
+            ids = list(self.scopes.get(scope, ()))
+            for entry_id in ids:
+                if self._expired(self.entries[entry_id], now):
+                    self._remove(entry_id)
+            ids = [entry_id for entry_id in ids if entry_id in self.entries]
+            if ids:
+                similarities = np.stack([self.entries[entry_id].vector for entry_id in ids]) @ query_vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.similarity_threshold:
+                    self.entries.move_to_end(ids[best])
+                    self.hits += 1
+                    entry = self.entries[ids[best]]
+                    print(f"Answer cache hit ({similarities[best]:.3f}) : {entry.query}")
+                    return entry.result
+            self.misses += 1
+            return None
+
+    def put(self, scope: Scope, query: str, vector: List[float], result: AIResults):
+        with self._lock:
+            entry_id = self.next_id
+            self.next_id += 1
+            self.entries[entry_id] = CacheEntry(scope, query, self.normalize(vector), result)
+            self.scopes.setdefault(scope, set()).add(entry_id)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+
+    def invalidate(self, endpoint: Optional[str] = None) -> int:
+        """Drop every entry, or only those of one endpoint. Returns the number of entries removed."""
+        with self._lock:
+            ids = [entry_id for entry_id, entry in self.entries.items() if endpoint is None or entry.scope[0] == endpoint]
+            for entry_id in ids:
+                self._remove(entry_id)
+            return len(ids)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,16 @@
+import asyncio
+from typing import Awaitable, Iterable, List, TypeVar
+
+T = TypeVar("T")
+
+async def gather_bounded(coros: Iterable[Awaitable[T]], limit: int) -> List[T]:
+    """
+    Await all coroutines concurrently with at most `limit` in flight, results are returned in input order.
+    """
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def run(coro: Awaitable[T]) -> T:
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*[run(coro) for coro in coros])
@@ -0,0 +1,93 @@
+import re
+import math
+from dataclasses import dataclass
+from typing import FrozenSet, List
+from config import config as config
+from monitoring import metrics as metrics
+from monitoring.tracing import span
+from .llm import profile_model
+
+packing_config = config.get_context_packing_config()
+
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n+")
+WORD = re.compile(r"\w+")
+
+
+@dataclass
+class PackingReport:
+    budget: int
+    input_tokens: int = 0
+    packed_tokens: int = 0
+    duplicate_sentences: int = 0
+    truncated_sentences: int = 0
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.input_tokens - self.packed_tokens
+
+
+def count_tokens(text: str) -> int:
+    # Gemini's tokenizer is not available locally; English text averages about 4 characters per token
+    return math.ceil(len(text) / packing_config.get('chars_per_token', 4))
+
+def token_budget(profile: str) -> int:
+    budgets = packing_config.get('budgets', {})
+    return budgets.get(profile_model(profile), packing_config.get('default_budget', 3000))
+
+def word_set(sentence: str) -> FrozenSet[str]:
+    return frozenset(WORD.findall(sentence.lower()))
+
+def is_near_duplicate(words: FrozenSet[str], kept: List[FrozenSet[str]], threshold: float) -> bool:
+    for other in kept:
+        union = len(words | other)
+        if union and len(words & other) / union >= threshold:
+            return True
+    return False
+
+def pack_context(passages: List[str], profile: str) -> str:
+    """
+    Pack `passages` (most relevant first) into the context budget of the `profile` LLM:
+    sentences that nearly repeat an earlier one (word Jaccard similarity >= duplicate_threshold) are dropped,
+    and packing stops at the first sentence that would exceed the budget.
+    Passages stay on their own lines.
+    """
+    if not packing_config.get('enabled', False):
+        return "\n".join(passages)
+    report = PackingReport(budget=token_budget(profile))
+    threshold = packing_config.get('duplicate_threshold', 0.8)
+    # The budget is tracked in characters, the unit of the token estimate
+    budget_chars = report.budget * packing_config.get('chars_per_token', 4)
+    kept_words: List[FrozenSet[str]] = []
+    packed: List[str] = []
+    packed_chars = 0
+    full = False
+    with span("context_packing"):
+        report.input_tokens = count_tokens("\n".join(passages))
+        for passage in passages:
+            sentences = []
+            for sentence in SENTENCE_BOUNDARY.split(passage):
+                sentence = sentence.strip()
+                if not sentence or full:
+                    report.truncated_sentences += bool(sentence)
+                    continue
+                words = word_set(sentence)
+                if is_near_duplicate(words, kept_words, threshold):
+                    report.duplicate_sentences += 1
+                    continue
+                # Plus the space or newline joining it to the previous sentence
+                if packed_chars + len(sentence) + 1 > budget_chars:
+                    full = True
+                    report.truncated_sentences += 1
+                    continue
+                kept_words.append(words)
+                sentences.append(sentence)
+                packed_chars += len(sentence) + 1
+            if sentences:
+                packed.append(" ".join(sentences))
+        context = "\n".join(packed)
+        report.packed_tokens = count_tokens(context)
+    metrics.context_tokens.labels("input").inc(report.input_tokens)
+    metrics.context_tokens.labels("packed").inc(report.packed_tokens)
+    print(f"Context packing ({profile}): {report.input_tokens} -> {report.packed_tokens} tokens, saved {report.saved_tokens} "
+          f"({report.duplicate_sentences} duplicate and {report.truncated_sentences} truncated sentences, budget {report.budget})")
+    return context
@@ -1,43 +1,53 @@
 from .utils import *
+from service.context_packing import pack_context
+from typing import AsyncIterator, Optional
 
-def crag_process(query: str, k:int = 5) -> str:
+async def gather_knowledge(query: str, k:int = 5, evaluator: Optional[str] = None) -> Tuple[Any, List[Tuple[str, str]]]:
     """
-    Process a query by retrieving, evaluating, and using documents or performing a web search to generate a response.
+    Retrieve and evaluate documents, then use them or perform a web search to collect the knowledge for the response.
 
     Args:
         query (str): The query string to process.
+        evaluator (Optional[str]): "llm" or "cross_encoder", defaults to crag.evaluator in cfg.yaml.
 
     Returns:
-        str: The generated response based on the query.
+        Tuple[Any, List[Tuple[str, str]]]: The final knowledge and the titles and links of its sources.
     """
     print(f"\nProcessing query: {query}")
 
     # Retrieve and evaluate documents
-    retrieved_docs = retrieve_documents(query, k)
-    eval_scores = evaluate_documents(query, retrieved_docs)
+    evaluator = evaluator or crag_config.get('evaluator', 'llm')
+    thresholds = get_evaluator_config(evaluator)
+    upper_threshold = thresholds.get('upper_threshold', 0.7)
+    lower_threshold = thresholds.get('lower_threshold', 0.3)
+    retrieved_docs = await retrieve_documents(query, k)
+    with span("evaluation"):
+        eval_scores = await evaluate_documents(query, retrieved_docs, evaluator)
     
     print(f"\nRetrieved {len(retrieved_docs)} documents")
-    print(f"Evaluation scores: {eval_scores}")
+    print(f"Evaluation scores ({evaluator}): {eval_scores}")
 
     # Determine action based on evaluation scores
     max_score = max(eval_scores)
     sources = []
     
-    if max_score > 0.7:
+    if max_score > upper_threshold:
         print("\nAction: Correct - Using retrieved document")
         best_doc = retrieved_docs[eval_scores.index(max_score)]
         final_knowledge = best_doc
         sources.append(("Retrieved document", ""))
-    elif max_score < 0.3:
+    elif max_score < lower_threshold:
         print("\nAction: Incorrect - Performing web search")
-        final_knowledge, sources = perform_web_search(query)
+        web_knowledge, sources = await perform_web_search(query)
+        final_knowledge = pack_context(web_knowledge, "crag_generation")
     else:
         print("\nAction: Ambiguous - Combining retrieved document and web search")
         best_doc = retrieved_docs[eval_scores.index(max_score)]
         # Refine the retrieved knowledge
-        retrieved_knowledge = knowledge_refinement(best_doc)
-        web_knowledge, web_sources = perform_web_search(query)
-        final_knowledge = "\n".join(retrieved_knowledge + web_knowledge)
+        retrieved_knowledge = await knowledge_refinement(best_doc)
+        web_knowledge, web_sources = await perform_web_search(query)
+        # Retrieved knowledge first: it was graded relevant, the web results were not
+        final_knowledge = pack_context(retrieved_knowledge + web_knowledge, "crag_generation")
         sources = [("Retrieved document", "")] + web_sources
 
     print("\nFinal knowledge:")
@@ -47,9 +57,34 @@ def crag_process(query: str, k:int = 5) -> str:
     for title, link in sources:
         print(f"{title}: {link}" if link else title)
 
+    return final_knowledge, sources
+
+async def crag_process(query: str, k:int = 5, evaluator: Optional[str] = None) -> str:
+    """
+    Process a query by retrieving, evaluating, and using documents or performing a web search to generate a response.
+
+    Args:
+        query (str): The query string to process.
+        evaluator (Optional[str]): "llm" or "cross_encoder", defaults to crag.evaluator in cfg.yaml.
+
+    Returns:
+        str: The generated response based on the query.
+    """
+    final_knowledge, sources = await gather_knowledge(query, k, evaluator)
+
     # Generate response
     print("\nGenerating response...")
-    response = generate_response(query, final_knowledge, sources)
+    response = await generate_response(query, final_knowledge, sources)
 
     print("\nResponse generated")
-    return response
\ No newline at end of file
+    return response
+
+async def crag_process_stream(query: str, k:int = 5, evaluator: Optional[str] = None) -> AsyncIterator[str]:
+    """
+    Same as crag_process, but yields the response tokens as they are generated.
+    """
+    final_knowledge, sources = await gather_knowledge(query, k, evaluator)
+
+    print("\nStreaming response...")
+    async for token in generate_response_stream(query, final_knowledge, sources):
+        yield token
\ No newline at end of file
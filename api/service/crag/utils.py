@@ -1,80 +1,108 @@
 import os
 import sys
 import json
+import asyncio
+import math
 from dotenv import load_dotenv
 from langchain.prompts import PromptTemplate
-from langchain_google_genai import ChatGoogleGenerativeAI
+from service.llm import llm_profile, lazy
 from langchain_core.pydantic_v1 import BaseModel, Field
-from typing import List, Dict, Any, Tuple
-from langchain_community.tools import DuckDuckGoSearchResults
+from typing import List, Dict, Any, Tuple, AsyncIterator
 from data.pinecone import search as search
+from service.concurrency import gather_bounded
+from service import rerank as rerank
+from service import web_search as web_search
+from monitoring.tracing import span
+from config import config as config
 
 
-llm = ChatGoogleGenerativeAI(model="gemini-1.0-pro-latest", temperature=0.8, top_p=0.5)
-llm1 = ChatGoogleGenerativeAI(model="gemini-1.5-flash-latest", temperature=0.8, top_p=0.5)
+def get_llm():
+    return llm_profile("crag_generation")
+
+def get_llm1():
+    return llm_profile("crag_evaluator")
+
+grading_config = config.get_grading_config()
+crag_config = config.get_crag_config()
 #Define retrieval evaluator, knowledge refinement and query rewriter llm chains
 # Retrieval Evaluator
 class RetrievalEvaluatorInput(BaseModel):
     relevance_score: float = Field(..., description="The relevance score of the document to the query. the score should be between 0 and 1.")
 
-def retrieval_evaluator(query: str, document: str) -> float:
-    prompt = PromptTemplate(
-        input_variables=["query", "document"],
-        template="On a scale from 0 to 1, how relevant is the following document to the query? Query: {query}\nDocument: {document}\nRelevance score:"
-    )
-    chain = prompt | llm1.with_structured_output(RetrievalEvaluatorInput)
+retrieval_evaluator_prompt = PromptTemplate(
+    input_variables=["query", "document"],
+    template="On a scale from 0 to 1, how relevant is the following document to the query? Query: {query}\nDocument: {document}\nRelevance score:"
+)
+get_retrieval_evaluator_chain = lazy(lambda: retrieval_evaluator_prompt | get_llm1().with_structured_output(RetrievalEvaluatorInput))
+
+async def retrieval_evaluator(query: str, document: str) -> float:
+    chain = get_retrieval_evaluator_chain()
     input_variables = {"query": query, "document": document}
-    result = chain.invoke(input_variables).relevance_score
+    result = (await chain.ainvoke(input_variables)).relevance_score
     return result
 
+class BatchRetrievalEvaluatorInput(BaseModel):
+    relevance_scores: List[float] = Field(..., description="The relevance score of each document to the query, one per document in the given order. Each score should be between 0 and 1.")
+
+batch_retrieval_evaluator_prompt = PromptTemplate(
+    input_variables=["query", "documents", "num_documents"],
+    template="On a scale from 0 to 1, how relevant is each of the following {num_documents} numbered documents to the query? Return exactly {num_documents} scores, in order. Query: {query}\n{documents}\nRelevance scores:"
+)
+get_batch_retrieval_evaluator_chain = lazy(lambda: batch_retrieval_evaluator_prompt | get_llm1().with_structured_output(BatchRetrievalEvaluatorInput))
+
+async def batch_retrieval_evaluator(query: str, documents: List[str]) -> List[float]:
+    chain = get_batch_retrieval_evaluator_chain()
+    numbered_documents = "\n".join(f"Document {i+1}: {document}" for i, document in enumerate(documents))
+    input_variables = {"query": query, "documents": numbered_documents, "num_documents": len(documents)}
+    return (await chain.ainvoke(input_variables)).relevance_scores
+
+# Cross-encoder Retrieval Evaluator
+def get_evaluator_config(evaluator: str) -> Dict[str, Any]:
+    return crag_config.get('evaluators', {}).get(evaluator, {})
+
+async def cross_encoder_evaluator(query: str, documents: List[str]) -> List[float]:
+    """
+    Score documents locally with the reranking cross-encoder, calibrated to 0-1 as sigmoid(scale * (logit - offset)).
+    """
+    calibration = get_evaluator_config("cross_encoder")
+    scale = calibration.get('scale', 1.0)
+    offset = calibration.get('offset', 0.0)
+    logits = await rerank.ascore_pairs(query, documents)
+    return [1.0 / (1.0 + math.exp(-scale * (logit - offset))) for logit in logits]
+
 # Knowledge Refinement
 class KnowledgeRefinementInput(BaseModel):
     key_points: str = Field(..., description="The document to extract key information from.")
-def knowledge_refinement(document: str) -> List[str]:
-    prompt = PromptTemplate(
-        input_variables=["document"],
-        template="Extract the key information from the following document in bullet points:\n{document}\nKey points:"
-    )
-    chain = prompt | llm.with_structured_output(KnowledgeRefinementInput)
+knowledge_refinement_prompt = PromptTemplate(
+    input_variables=["document"],
+    template="Extract the key information from the following document in bullet points:\n{document}\nKey points:"
+)
+get_knowledge_refinement_chain = lazy(lambda: knowledge_refinement_prompt | get_llm().with_structured_output(KnowledgeRefinementInput))
+
+async def knowledge_refinement(document: str) -> List[str]:
+    chain = get_knowledge_refinement_chain()
     input_variables = {"document": document}
-    result = chain.invoke(input_variables).key_points
+    with span("knowledge_refinement"):
+        result = (await chain.ainvoke(input_variables)).key_points
     return [point.strip() for point in result.split('\n') if point.strip()]
 
 # Web Search Query Rewriter
 class QueryRewriterInput(BaseModel):
     query: str = Field(..., description="The query to rewrite.")
-def rewrite_query(query: str) -> str:
-    prompt = PromptTemplate(
-        input_variables=["query"],
-        template="Rewrite the following query to make it more suitable for a web search:\n{query}\nRewritten query:"
-    )
-    chain = prompt | llm.with_structured_output(QueryRewriterInput)
+query_rewriter_prompt = PromptTemplate(
+    input_variables=["query"],
+    template="Rewrite the following query to make it more suitable for a web search:\n{query}\nRewritten query:"
+)
+get_query_rewriter_chain = lazy(lambda: query_rewriter_prompt | get_llm().with_structured_output(QueryRewriterInput))
+
+async def rewrite_query(query: str) -> str:
+    chain = get_query_rewriter_chain()
     input_variables = {"query": query}
-    return chain.invoke(input_variables).query.strip()
-
-
-def parse_search_results(results_string: str) -> List[Tuple[str, str]]:
-    """
-    Parse a JSON string of search results into a list of title-link tuples.
+    with span("web_query_rewrite"):
+        return (await chain.ainvoke(input_variables)).query.strip()
 
-    Args:
-        results_string (str): A JSON-formatted string containing search results.
 
-    Returns:
-        List[Tuple[str, str]]: A list of tuples, where each tuple contains the title and link of a search result.
-                               If parsing fails, an empty list is returned.
-    """
-    try:
-        # Attempt to parse the JSON string
-        results = json.loads(results_string)
-        # Extract and return the title and link from each result
-        return [(result.get('title', 'Untitled'), result.get('link', '')) for result in results]
-    except json.JSONDecodeError:
-        # Handle JSON decoding errors by returning an empty list
-        print("Error parsing search results. Returning empty list.")
-        return []
-    
-def retrieve_documents(query: str, k: int = 3) -> List[str]:
+async def retrieve_documents(query: str, k: int = 3) -> List[str]:
     """
     Retrieve documents based on a query using a FAISS index.
 
@@ -86,23 +114,33 @@ def retrieve_documents(query: str, k: int = 3) -> List[str]:
     Returns:
         List[str]: A list of the retrieved document contents.
     """
-    docs = search.similarity_search([query], k = k)
+    docs = await search.asimilarity_search([query], k = k)
     return [doc.page_content for doc in docs]
 
-def evaluate_documents(query: str, documents: List[str]) -> List[float]:
+async def evaluate_documents(query: str, documents: List[str], evaluator: str = "llm") -> List[float]:
     """
     Evaluate the relevance of documents based on a query.
+    With the "llm" evaluator documents are scored concurrently, or in a single request when grading.mode is "single_call".
 
     Args:
         query (str): The query string.
         documents (List[str]): A list of document contents to evaluate.
+        evaluator (str): "llm" or "cross_encoder".
 
     Returns:
         List[float]: A list of relevance scores for each document.
     """
-    return [retrieval_evaluator(query, doc) for doc in documents]
-
-def perform_web_search(query: str) -> Tuple[List[str], List[Tuple[str, str]]]:
+    if evaluator == "cross_encoder":
+        return await cross_encoder_evaluator(query, documents)
+    if grading_config.get('mode') == 'single_call' and len(documents) > 1:
+        scores = await batch_retrieval_evaluator(query, documents)
+        if len(scores) == len(documents):
+            return scores
+        print(f"Single call evaluation returned {len(scores)} scores for {len(documents)} documents")
+    return await gather_bounded([retrieval_evaluator(query, doc) for doc in documents],
+                                grading_config.get('max_concurrency', 4))
+
+async def perform_web_search(query: str) -> Tuple[List[str], List[Tuple[str, str]]]:
     """
     Perform a web search based on a query.
 
@@ -114,13 +152,30 @@ def perform_web_search(query: str) -> Tuple[List[str], List[Tuple[str, str]]]:
             - A list of refined knowledge obtained from the web search.
             - A list of tuples containing titles and links of the sources.
     """
-    rewritten_query = rewrite_query(query)
-    web_results = search.run(rewritten_query)
-    web_knowledge = knowledge_refinement(web_results)
-    sources = parse_search_results(web_results)
+    rewritten_query = await rewrite_query(query)
+    results = await web_search.asearch(rewritten_query)
+    if not results:
+        # Nothing found, or the search engine missed its deadline
+        return [], []
+    web_knowledge = await knowledge_refinement("\n".join(f"{result['title']}: {result['snippet']}" for result in results))
+    sources = [(result.get('title', 'Untitled'), result.get('link', '')) for result in results]
     return web_knowledge, sources
 
-def generate_response(query: str, knowledge: str, sources: List[Tuple[str, str]]) -> str:
+response_prompt = PromptTemplate(
+    input_variables=["query", "knowledge", "sources"],
+    template="Based on the following knowledge, answer the query. Include the sources with their links (if available) at the end of your answer:\nQuery: {query}\nKnowledge: {knowledge}\nSources: {sources}\nAnswer:"
+)
+get_response_chain = lazy(lambda: response_prompt | get_llm())
+
+def build_response_chain(query: str, knowledge: str, sources: List[Tuple[str, str]]):
+    input_variables = {
+        "query": query,
+        "knowledge": knowledge,
+        "sources": "\n".join([f"{title}: {link}" if link else title for title, link in sources])
+    }
+    return get_response_chain(), input_variables
+
+async def generate_response(query: str, knowledge: str, sources: List[Tuple[str, str]]) -> str:
     """
     Generate a response to a query using knowledge and sources.
 
@@ -132,14 +187,14 @@ def generate_response(query: str, knowledge: str, sources: List[Tuple[str, str]]
     Returns:
         str: The generated response.
     """
-    response_prompt = PromptTemplate(
-        input_variables=["query", "knowledge", "sources"],
-        template="Based on the following knowledge, answer the query. Include the sources with their links (if available) at the end of your answer:\nQuery: {query}\nKnowledge: {knowledge}\nSources: {sources}\nAnswer:"
-    )
-    input_variables = {
-        "query": query,
-        "knowledge": knowledge,
-        "sources": "\n".join([f"{title}: {link}" if link else title for title, link in sources])
-    }
-    response_chain = response_prompt | llm
-    return response_chain.invoke(input_variables).content
\ No newline at end of file
+    response_chain, input_variables = build_response_chain(query, knowledge, sources)
+    with span("generation"):
+        return (await response_chain.ainvoke(input_variables)).content
+
+async def generate_response_stream(query: str, knowledge: str, sources: List[Tuple[str, str]]) -> AsyncIterator[str]:
+    """
+    Generate a response like generate_response, yielding the text as it is produced by the LLM.
+    """
+    response_chain, input_variables = build_response_chain(query, knowledge, sources)
+    async for chunk in response_chain.astream(input_variables):
+        yield chunk.content
\ No newline at end of file
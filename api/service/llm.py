@@ -0,0 +1,85 @@
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
+from langchain_google_genai import ChatGoogleGenerativeAI
+from config import config as config
+from .ratelimit import get_rate_limiter, async_rate_limited, TokenUsageCallback
+from monitoring.tracing import LLMTracingCallback
+
+T = TypeVar("T")
+
+
+def chat_model(model: str, temperature: float = 0.7, top_p: Optional[float] = None) -> ChatGoogleGenerativeAI:
+    """
+    Build a Gemini chat client that goes through the shared rate limiter of its model and reports its usage to the request trace.
+    """
+    limiter = get_rate_limiter(model)
+    return async_rate_limited(ChatGoogleGenerativeAI)(model=model, temperature=temperature, top_p=top_p,
+                                                      rate_limiter=limiter, callbacks=[TokenUsageCallback(limiter), LLMTracingCallback(model)])
+
+
+def lazy(factory: Callable[[], T]) -> Callable[[], T]:
+    """
+    Turn `factory` into a thread-safe accessor that builds the value on first call and reuses it afterwards.
+    """
+    lock = threading.Lock()
+    value = []
+
+    def get() -> T:
+        if not value:
+            with lock:
+                if not value:
+                    value.append(factory())
+        return value[0]
+
+    return get
+
+
+
+"""
+Client registry: one client per (model, temperature, top_p), all sharing the same Gemini connections.
+Call sites pick their client by role from the `llm_profiles` section of cfg.yaml.
+"""
+
+clients: Dict[Tuple[str, float, Optional[float]], ChatGoogleGenerativeAI] = {}
+_clients_lock = threading.Lock()
+# The sync and async Gemini service clients of the first registered clients, reused by all the others
+transport: Dict[str, Any] = {"client": None, "async_client": None}
+
+def share_transport(client: ChatGoogleGenerativeAI) -> ChatGoogleGenerativeAI:
+    if "async_client" not in getattr(type(client), "__fields__", {}):
+        return client
+    for name in ("client", "async_client"):
+        if transport[name] is None:
+            transport[name] = getattr(client, name)
+        else:
+            setattr(client, name, transport[name])
+    return client
+
+def get_client(model: str, temperature: float = 0.7, top_p: Optional[float] = None) -> ChatGoogleGenerativeAI:
+    key = (model, temperature, top_p)
+    with _clients_lock:
+        if key not in clients:
+            clients[key] = share_transport(chat_model(model, temperature, top_p))
+        return clients[key]
+
+def profile_model(name: str) -> str:
+    """Model of the `name` profile in cfg.yaml. A profile without a model uses llm_model.model_name."""
+    profile = config.get_llm_profiles_config().get('profiles', {})[name]
+    return profile.get('model') or config.get_llm_model_config()['model_name']
+
+def llm_profile(name: str) -> ChatGoogleGenerativeAI:
+    """Shared client of the `name` profile in cfg.yaml."""
+    profile = config.get_llm_profiles_config().get('profiles', {})[name]
+    return get_client(profile_model(name), profile.get('temperature', 0.7), profile.get('top_p'))
+
+def attach_async_transport():
+    """
+    Must run on the event loop. Clients built in worker threads (e.g. by the warm-up) get no async transport,
+    so their ainvoke would fall back to the sync client on a thread; give them the one built here instead.
+    """
+    if transport["async_client"] is None:
+        probe = chat_model(config.get_llm_model_config()['model_name'])
+        transport["async_client"] = getattr(probe, "async_client", None)
+    with _clients_lock:
+        for client in clients.values():
+            share_transport(client)
@@ -0,0 +1,76 @@
+import os
+import json
+import asyncio
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from config import config as config
+from data.pinecone import init as db
+from monitoring import metrics as metrics
+from .llm import lazy
+
+classifier_config = config.get_local_classifier_config()
+
+
+class CentroidClassifier:
+    """
+    Nearest-centroid classifier over query embeddings, one independent set of labelled centroids per task
+    ("routing", "category"). Centroids are built from labelled exemplar queries by `data/router/build_centroids.py`.
+    """
+    def __init__(self, model_name: str, tasks: Dict[str, Tuple[List[str], np.ndarray]]):
+        self.model_name = model_name
+        self.tasks = tasks
+
+    @classmethod
+    def load(cls, path: str) -> "CentroidClassifier":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        tasks = {}
+        for task, entry in data["tasks"].items():
+            centroids = np.asarray(entry["centroids"], dtype=np.float32)
+            centroids /= np.linalg.norm(centroids, axis=1, keepdims=True)
+            tasks[task] = (entry["labels"], centroids)
+        return cls(data["model"], tasks)
+
+    def predict(self, task: str, vector: List[float]) -> Tuple[str, float]:
+        """
+        Nearest label for `vector` and its margin, the cosine similarity gap to the runner-up label.
+        """
+        labels, centroids = self.tasks[task]
+        query = np.asarray(vector, dtype=np.float32)
+        similarities = centroids @ (query / np.linalg.norm(query))
+        order = np.argsort(-similarities)
+        margin = float(similarities[order[0]] - similarities[order[1]]) if len(order) > 1 else 1.0
+        return labels[order[0]], margin
+
+
+def load_classifier() -> Optional[CentroidClassifier]:
+    if not classifier_config.get('enabled', False):
+        return None
+    path = classifier_config.get('path', 'data/router/centroids.json')
+    if not os.path.exists(path):
+        print(f"No centroids at {path}, routing and classification use the LLM. Build them with `python -m data.router.build_centroids`")
+        return None
+    classifier = CentroidClassifier.load(path)
+    embedding_model = config.get_database_config()['embedding_model']
+    if classifier.model_name != embedding_model:
+        print(f"Centroids at {path} were built with {classifier.model_name}, not {embedding_model}; ignoring them")
+        return None
+    return classifier
+
+get_classifier = lazy(load_classifier)
+
+async def classify(task: str, query: str) -> Optional[str]:
+    """
+    Label of `query` for `task` if the local classifier is confident about it, None when the caller should ask the LLM.
+    """
+    classifier = await asyncio.to_thread(get_classifier)
+    if classifier is None or task not in classifier.tasks:
+        return None
+    # Same embedding call as retrieval, so the query embedding cache is shared
+    vector = (await asyncio.to_thread(db.get_embeddings().embed_documents, [query]))[0]
+    label, margin = classifier.predict(task, vector)
+    if margin < classifier_config.get('min_margin', {}).get(task, 0.05):
+        metrics.local_classifier_decisions.labels(task, "escalated").inc()
+        return None
+    metrics.local_classifier_decisions.labels(task, "local").inc()
+    return label
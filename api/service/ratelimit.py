@@ -0,0 +1,154 @@
+import time
+import asyncio
+import threading
+from functools import lru_cache
+from typing import Any, Dict, Optional
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langchain_core.rate_limiters import BaseRateLimiter
+from config import config as config
+
+
+class TokenBucket:
+    """
+    Bucket refilled continuously at `per_minute` units per minute, holding at most `per_minute` units.
+    The level may go negative when usage is charged after the fact (token counts are only known once the call returns).
+    """
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = float(per_minute) / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until the bucket holds `amount` units, 0 if it already does."""
+        self.refill(now)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+
+class ModelRateLimiter(BaseRateLimiter):
+    """
+    Requests/min and tokens/min limiter shared by every client of one model.
+
+    A call goes straight through while both buckets have headroom; it only waits when the request bucket is empty
+    or the token bucket is in debt.
+    langchain-core calls the sync `acquire` from its async paths too, on the event loop where sleeping would stall
+    every request; there it returns at once and the client awaits `aacquire` instead (see `async_rate_limited`).
+    """
+    def __init__(self, model: str, requests_per_minute: float, tokens_per_minute: Optional[float] = None):
+        self.model = model
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._lock = threading.Lock()
+
+    def _try_acquire(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            wait = self.requests.wait_time(1, now)
+            if self.tokens is not None:
+                wait = max(wait, self.tokens.wait_time(0, now))
+            if wait == 0:
+                self.requests.level -= 1
+            return wait
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        if on_event_loop():
+            return True
+        while True:
+            wait = self._try_acquire()
+            if wait == 0:
+                return True
+            if not blocking:
+                return False
+            print(f"Rate limit reached for {self.model}, waiting {wait:.1f}s")
+            time.sleep(wait)
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        while True:
+            wait = self._try_acquire()
+            if wait == 0:
+                return True
+            if not blocking:
+                return False
+            print(f"Rate limit reached for {self.model}, waiting {wait:.1f}s")
+            await asyncio.sleep(wait)
+
+    def record_tokens(self, count: int):
+        if self.tokens is None or count <= 0:
+            return
+        with self._lock:
+            self.tokens.refill(time.monotonic())
+            self.tokens.level -= count
+
+
+def on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+@lru_cache(maxsize=None)
+def async_rate_limited(chat_model_class: type) -> type:
+    """
+    Subclass of `chat_model_class` whose async calls await the `aacquire` of its rate limiter before going out.
+    Its sync calls keep going through langchain-core's blocking `acquire`.
+    """
+    class AsyncRateLimited(chat_model_class):
+        async def _agenerate(self, *args: Any, **kwargs: Any):
+            if self.rate_limiter is not None:
+                await self.rate_limiter.aacquire()
+            return await super()._agenerate(*args, **kwargs)
+
+        async def _astream(self, *args: Any, **kwargs: Any):
+            if self.rate_limiter is not None:
+                await self.rate_limiter.aacquire()
+            async for chunk in super()._astream(*args, **kwargs):
+                yield chunk
+
+    AsyncRateLimited.__name__ = AsyncRateLimited.__qualname__ = chat_model_class.__name__
+    return AsyncRateLimited
+
+
+def usage_tokens(response: LLMResult) -> int:
+    total = 0
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                total += usage.get("total_tokens", 0)
+    return total
+
+
+class TokenUsageCallback(BaseCallbackHandler):
+    """Charges the token usage reported by each completed call to the model's limiter."""
+    run_inline = True
+
+    def __init__(self, limiter: ModelRateLimiter):
+        self.limiter = limiter
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        self.limiter.record_tokens(usage_tokens(response))
+
+
+rate_limiters: Dict[str, ModelRateLimiter] = {}
+_lock = threading.Lock()
+
+def get_rate_limiter(model: str) -> ModelRateLimiter:
+    with _lock:
+        if model not in rate_limiters:
+            rate_limit_config = config.get_rate_limit_config()
+            limits = rate_limit_config.get('models', {}).get(model) or rate_limit_config.get('default', {})
+            rate_limiters[model] = ModelRateLimiter(
+                model,
+                requests_per_minute = limits.get('requests_per_minute', 15),
+                tokens_per_minute = limits.get('tokens_per_minute'),
+            )
+        return rate_limiters[model]
@@ -1,21 +1,87 @@
 # from .init import cross_encoder
 from langchain.docstore.document import Document
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Optional, Tuple
+import inspect
+import asyncio
+import threading
+import torch
 
 from sentence_transformers import CrossEncoder
+from config import config as config
+from .rerank_batcher import RerankBatcher
+from monitoring.tracing import span
 
-cross_encoder = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2')
+rerank_config = config.get_rerank_config()
 
-def reranking_relevant_documents(query: str, initial_docs : List[Document], rerank_top_k = -1) -> List[Document]:        
-    # Prepare pairs for cross-encoder
-    pairs = [[query, doc.page_content] for doc in initial_docs]
-    
-    # Get cross-encoder scores
-    scores = cross_encoder.predict(pairs)
-    
+cross_encoder = None
+_lock = threading.Lock()
+
+# The model is loaded on first use (or by the startup warm-up), not at import time
+def get_cross_encoder() -> CrossEncoder:
+    global cross_encoder
+    if cross_encoder is None:
+        with _lock:
+            if cross_encoder is None:
+                cross_encoder = CrossEncoder(rerank_config.get('model_name', 'cross-encoder/ms-marco-MiniLM-L-6-v2'),
+                                             max_length=rerank_config.get('max_length', 512))
+    return cross_encoder
+
+def predict_logits(pairs: List[Tuple[str, str]], batch_size: Optional[int] = None) -> List[float]:
+    """
+    Raw cross-encoder logits for (query, passage) pairs, without any activation applied,
+    in forward passes of `batch_size` pairs (rerank.max_batch_pairs by default).
+    """
+    cross_encoder = get_cross_encoder()
+    # sentence-transformers renamed `activation_fct` to `activation_fn` in v4
+    activation_kwarg = 'activation_fn' if 'activation_fn' in inspect.signature(cross_encoder.predict).parameters else 'activation_fct'
+    scores = cross_encoder.predict([list(pair) for pair in pairs],
+                                   batch_size=batch_size or rerank_config.get('max_batch_pairs', 64),
+                                   **{activation_kwarg: torch.nn.Identity()})
+    return [float(score) for score in scores]
+
+# Concurrent requests are scored together by a background micro-batching thread
+batcher = RerankBatcher(predict_logits,
+                        max_batch_pairs=rerank_config.get('max_batch_pairs', 64),
+                        batch_window_ms=rerank_config.get('batch_window_ms', 5))
+
+def score_pairs(query: str, passages: List[str]) -> List[float]:
+    pairs = [(query, passage) for passage in passages]
+    if rerank_config.get('batching', True):
+        return batcher.score(pairs)
+    return predict_logits(pairs) if pairs else []
+
+async def ascore_pairs(query: str, passages: List[str]) -> List[float]:
+    pairs = [(query, passage) for passage in passages]
+    if rerank_config.get('batching', True):
+        return await batcher.ascore(pairs)
+    return await asyncio.to_thread(predict_logits, pairs) if pairs else []
+
+async def ascore_bulk(pairs: List[Tuple[str, str]]) -> List[float]:
+    """
+    Logits of many pairs at once, for batch jobs: they are scored in forward passes of rerank.bulk_batch_pairs,
+    without going through the micro-batcher whose batches are sized for interactive requests.
+    """
+    with span("rerank"):
+        return await asyncio.to_thread(predict_logits, pairs, rerank_config.get('bulk_batch_pairs', 256)) if pairs else []
+
+def sort_by_score(initial_docs: List[Document], scores: List[float]) -> List[Document]:
     # Sort documents by score
     scored_docs = sorted(zip(initial_docs, scores), key=lambda x: x[1], reverse=True)
     
     # Return top reranked documents
     # return [doc for doc, _ in scored_docs[:rerank_top_k]]
-    return [doc for doc, _ in scored_docs]
\ No newline at end of file
+    return [doc for doc, _ in scored_docs]
+
+def reranking_relevant_documents(query: str, initial_docs : List[Document], rerank_top_k = -1) -> List[Document]:        
+    # Get cross-encoder scores
+    scores = score_pairs(query, [doc.page_content for doc in initial_docs])
+    return sort_by_score(initial_docs, scores)
+
+async def arerank_with_scores(query: str, initial_docs : List[Document]) -> List[Tuple[Document, float]]:
+    """Documents sorted by cross-encoder logit, with their logits."""
+    with span("rerank"):
+        scores = await ascore_pairs(query, [doc.page_content for doc in initial_docs])
+    return sorted(zip(initial_docs, scores), key=lambda x: x[1], reverse=True)
+
+async def areranking_relevant_documents(query: str, initial_docs : List[Document], rerank_top_k = -1) -> List[Document]:
+    return [doc for doc, _ in await arerank_with_scores(query, initial_docs)]
\ No newline at end of file
@@ -0,0 +1,98 @@
+import time
+import queue
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Callable, List, Sequence, Tuple
+from monitoring import metrics as metrics
+
+Pair = Tuple[str, str]
+
+
+class RerankRequest:
+    def __init__(self, pairs: Sequence[Pair]):
+        self.pairs = list(pairs)
+        self.future: Future = Future()
+        self.enqueued = time.monotonic()
+
+
+class RerankBatcher:
+    """
+    Collects (query, passage) pairs from concurrent callers and scores them in one batched forward pass.
+
+    A background thread waits for the first request, then keeps collecting for `batch_window_ms`
+    or until `max_batch_pairs` pairs are queued, scores everything with `score_fn` and hands each caller its slice.
+    Batch sizes and queue waits are recorded in the rag_rerank_* Prometheus histograms.
+    """
+    def __init__(self, score_fn: Callable[[List[Pair]], Sequence[float]], max_batch_pairs: int = 64, batch_window_ms: float = 5.0):
+        self.score_fn = score_fn
+        self.max_batch_pairs = max_batch_pairs
+        self.batch_window = batch_window_ms / 1000.0
+        self.queue: "queue.Queue[RerankRequest]" = queue.Queue()
+        self.thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="rerank-batcher", daemon=True)
+                self.thread.start()
+
+    def submit(self, pairs: Sequence[Pair]) -> Future:
+        request = RerankRequest(pairs)
+        if not request.pairs:
+            request.future.set_result([])
+            return request.future
+        self.start()
+        self.queue.put(request)
+        return request.future
+
+    def score(self, pairs: Sequence[Pair]) -> List[float]:
+        return self.submit(pairs).result()
+
+    async def ascore(self, pairs: Sequence[Pair]) -> List[float]:
+        return await asyncio.wrap_future(self.submit(pairs))
+
+    def _collect(self) -> List[RerankRequest]:
+        batch: List[RerankRequest] = []
+        num_pairs = 0
+        deadline = None
+        while num_pairs < self.max_batch_pairs:
+            if deadline is None:
+                request = self.queue.get()
+                deadline = time.monotonic() + self.batch_window
+            else:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+            # Drop requests whose caller has gone away, the others can no longer be cancelled
+            if request.future.set_running_or_notify_cancel():
+                batch.append(request)
+                num_pairs += len(request.pairs)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if not batch:
+                continue
+            started = time.monotonic()
+            pairs = [pair for request in batch for pair in request.pairs]
+            metrics.rerank_batch_size.observe(len(pairs))
+            for request in batch:
+                metrics.rerank_queue_wait.observe(started - request.enqueued)
+            try:
+                scores = [float(score) for score in self.score_fn(pairs)]
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            offset = 0
+            for request in batch:
+                request.future.set_result(scores[offset:offset + len(request.pairs)])
+                offset += len(request.pairs)
+
@@ -1,5 +1,7 @@
 from langchain.prompts import ChatPromptTemplate
-from langchain_google_genai import ChatGoogleGenerativeAI
+from .llm import llm_profile, lazy
+from . import local_classifier as local_classifier
+from monitoring.tracing import span
 from langchain_core.pydantic_v1 import BaseModel, Field
 from typing import List, Dict, Any, Tuple
 
@@ -8,19 +10,21 @@ class relation_check(BaseModel):
     # setup: str = Field(description="Original query")
     check: bool  = Field(description="Is the query relevant?", )
 
-def routing_query(query : str) -> bool:
-    template = """You are a helpful assistant to check if the question is related to focusing on how to influence others focusing on improving interpersonal relationships by being genuinely interested in others, 
+template = """You are a helpful assistant to check if the question is related to focusing on how to influence others focusing on improving interpersonal relationships by being genuinely interested in others, 
     listening attentively and showing genuine appreciation.
     
     The question: {question} \n
     Output : True or False"""
-    prompt= ChatPromptTemplate.from_template(template)
-    llm = ChatGoogleGenerativeAI(model="gemini-1.0-pro-latest", temperature=0.8, top_p=0.5)
-    structured_llm = llm.with_structured_output(relation_check)
-    checking_chain = (
-        prompt 
-        | structured_llm
-    )
-    result = checking_chain.invoke({"question" : query})
+prompt = ChatPromptTemplate.from_template(template)
+get_routing_chain = lazy(lambda: prompt | llm_profile("router").with_structured_output(relation_check))
+
+async def routing_query(query : str) -> bool:
+    with span("routing_local"):
+        label = await local_classifier.classify("routing", query)
+    if label is not None:
+        return label == "related"
+    checking_chain = get_routing_chain()
+    with span("routing"):
+        result = await checking_chain.ainvoke({"question" : query})
     return result.check
-    
\ No newline at end of file
+    
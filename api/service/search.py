@@ -1,58 +1,308 @@
 import os
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
 from data.pinecone import search as search
+from data.pinecone import init as db
 from model.airesults import AIResults
 from model.resource import Resource
 from .adaptive_retrieval.adaptive_retrieval import AdaptiveRAG
+from .adaptive_retrieval import bandit as bandit
 from langchain_core.runnables import  RunnablePassthrough
 from langchain.prompts import ChatPromptTemplate
-from langchain_google_genai import GoogleGenerativeAI
 from langchain_core.output_parsers import StrOutputParser
 from .self_rag import self_rag as self_rag
 from .crag import crag as crag
 from config import config as config
+from .llm import llm_profile, lazy
+from . import route as route
+from . import rerank as rerank
+from .answer_cache import SemanticAnswerCache, make_scope
+from .single_flight import SingleFlight
+from monitoring import metrics as metrics
+from monitoring.tracing import span
 
-llm_model_name = config.get_llm_model_config()['model_name']
 
-adaptive_query_engine = AdaptiveRAG()
+get_adaptive_query_engine = lazy(AdaptiveRAG)
 
-def get_query(query:str)-> list[Resource]:
-    resources, _ = search.similarity_search(query)
-    return resources
+answer_cache_config = config.get_answer_cache_config()
+answer_cache = SemanticAnswerCache(
+    similarity_threshold = answer_cache_config.get('similarity_threshold', 0.95),
+    ttl_seconds = answer_cache_config.get('ttl_seconds', 3600),
+    max_entries = answer_cache_config.get('max_entries', 1024),
+)
 
-def do_self_rag(query:str, top_k) -> str:
-    response = self_rag.self_rag(query=query, top_k = top_k)
+routing_config = config.get_routing_config()
+
+single_flight_config = config.get_single_flight_config()
+flights = SingleFlight()
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+async def answer(endpoint: str, query: str, params: Dict[str, Any], pipeline: Callable[[], Awaitable[AIResults]]) -> AIResults:
+    """
+    Answer a query with `pipeline` if it is related to the book, with the plain LLM otherwise.
+    Identical concurrent queries (same endpoint, normalized query and parameters) share one computation.
+    """
+    if not single_flight_config.get('enabled', False):
+        return await cached_answer(endpoint, query, params, pipeline)
+    key = (make_scope(endpoint, params), normalize_query(query))
+    result, shared = await flights.do(key, lambda: cached_answer(endpoint, query, params, pipeline))
+    metrics.coalesced_requests.labels(endpoint, "follower" if shared else "leader").inc()
+    # The strategy pull behind the answer can only be rated once, by the request that computed it
+    return without_feedback_id(result) if shared else result
+
+async def cached_answer(endpoint: str, query: str, params: Dict[str, Any], pipeline: Callable[[], Awaitable[AIResults]]) -> AIResults:
+    """
+    A previous answer of a similar query with the same endpoint and parameters from the answer cache, or a routed answer.
+    """
+    if not answer_cache_config.get('enabled', False):
+        return await routed_answer(query, pipeline)
+    # Same embedding call as retrieval, so the query embedding cache is shared
+    with span("answer_cache"):
+        vector = (await asyncio.to_thread(db.get_embeddings().embed_documents, [query]))[0]
+        scope = make_scope(endpoint, params)
+        result = answer_cache.lookup(scope, vector)
+    if result is None:
+        result = await routed_answer(query, pipeline)
+        # Cache hits did not run the retrieval strategy, they get no feedback id
+        answer_cache.put(scope, query, vector, without_feedback_id(result))
+    return result
+
+def without_feedback_id(result: AIResults) -> AIResults:
+    return result.model_copy(update={"feedback_id": None}) if result.feedback_id is not None else result
+
+def discard(task: asyncio.Future):
+    """Cancel speculative work and swallow whatever it ends with."""
+    task.cancel()
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+async def routed_answer(query: str, pipeline: Callable[[], Awaitable[AIResults]]) -> AIResults:
+    """
+    Answer with `pipeline` if the router says the query is related to the book, with the plain LLM otherwise.
+    In speculative mode the pipeline starts at the same time as the router and is cancelled if the query is off-topic.
+    """
+    if not routing_config.get('speculative', False):
+        if await route.routing_query(query):
+            print("This question is related to the book !!")
+            return await pipeline()
+        return await get_llm_response(query)
+    speculative = asyncio.ensure_future(pipeline())
+    try:
+        related = await route.routing_query(query)
+    except BaseException:
+        discard(speculative)
+        raise
+    if related:
+        print("This question is related to the book !!")
+        return await speculative
+    discard(speculative)
+    return await get_llm_response(query)
+
+async def routed_stream(query: str, stream_pipeline: Callable[[], AsyncIterator[Tuple[str, Any]]]) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Streaming counterpart of `routed_answer`.
+    In speculative mode the pipeline runs up to its first event (the retrieved resources) while the router decides.
+    """
+    if not routing_config.get('speculative', False):
+        if await route.routing_query(query):
+            print("This question is related to the book !!")
+            events = stream_pipeline()
+        else:
+            events = stream_llm_response(query)
+        async for event in events:
+            yield event
+        return
+    events = stream_pipeline()
+    first = asyncio.ensure_future(events.__anext__())
+    try:
+        related = await route.routing_query(query)
+    except BaseException:
+        discard(first)
+        raise
+    if not related:
+        discard(first)
+        # Let the cancellation land before closing the generator it is running
+        await asyncio.wait([first])
+        await events.aclose()
+        async for event in stream_llm_response(query):
+            yield event
+        return
+    print("This question is related to the book !!")
+    try:
+        yield await first
+    except StopAsyncIteration:
+        return
+    async for event in events:
+        yield event
+
+async def get_query(query:str)-> list[Resource]:
+    docs = await search.asimilarity_search([query])
+    return [search.results_to_model(doc) for doc in docs]
+
+async def do_self_rag(query:str, top_k) -> str:
+    response = await self_rag.self_rag(query=query, top_k = top_k)
     print("Response : ", response)
     default_text = f"""Result of Self-RAG: \n\n"""
     return AIResults(text = default_text + response, ResourceCollection=[]) 
 
-def do_crag(query:str, k:int) -> str:
-    response = crag.crag_process(query=query, k = k)
+async def do_crag(query:str, k:int, evaluator: Optional[str] = None) -> str:
+    response = await crag.crag_process(query=query, k = k, evaluator = evaluator)
     print("Response : ", response)
     default_text = f"""Result of CRAG: \n\n"""
     return AIResults(text = default_text + response, ResourceCollection=[]) 
 
-def get_adaptive_query(query:str, k:int = 3, rerank_mode: bool = True, query_category = "Auto") -> str:
-    response, resources = adaptive_query_engine.answer(query, k, rerank_mode, query_category)
+async def get_adaptive_query(query:str, k:int = 3, rerank_mode: bool = True, query_category = "Auto") -> str:
+    response, resources, feedback_id = await get_adaptive_query_engine().answer(query, k, rerank_mode, query_category)
     print("Response : ", response)
     print("resources : ", len(resources))
     default_text = f"""Rerank_mode : {rerank_mode}, query_category : {query_category} \n\n"""
-    return AIResults(text = default_text + response, ResourceCollection=resources) 
+    return AIResults(text = default_text + response, ResourceCollection=resources, feedback_id=feedback_id) 
+
+def submit_feedback(feedback_id: str, score: float) -> Optional[Dict[str, str]]:
+    """Reward the retrieval strategy of an adaptive answer with user feedback. None if the id is unknown or expired."""
+    pull = bandit.get_bandit().feedback(feedback_id, score)
+    if pull is None:
+        return None
+    return {"category": pull.category, "strategy": pull.strategy}
+
+"""
+Batch queries: one pipeline over many queries, results yielded per query as {"index", "query", "result"} or {"index", "query", "error"}.
+"""
+
+batch_config = config.get_batch_config()
 
-def get_llm_response(query:str) -> str:
-    template = """
+def batch_pipelines(params: Dict[str, Any]) -> Dict[str, Callable[[str], Awaitable[AIResults]]]:
+    """Per-query runners of the LLM pipelines, with the same defaults and answer cache scopes as their GET endpoints."""
+    k, top_k = params.get("k"), params.get("top_k") or 3
+    rerank_mode, query_category, evaluator = params.get("rerank_mode", True), params.get("query_category", "Auto"), params.get("evaluator")
+    return {
+        "llm": lambda query: get_llm_response(query),
+        "self_rag": lambda query: answer("self_rag", query, {"top_k": top_k}, lambda: do_self_rag(query, top_k)),
+        "crag": lambda query: answer("crag", query, {"k": k or 4, "evaluator": evaluator},
+                                     lambda: do_crag(query, k or 4, evaluator)),
+        "adaptive_query": lambda query: answer("adaptive_query", query, {"k": k or 5, "rerank_mode": rerank_mode, "query_category": query_category},
+                                               lambda: get_adaptive_query(query, k or 5, rerank_mode, query_category)),
+    }
+
+async def batch_resources(queries: List[str], k: int, rerank_mode: bool) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Retrieval only: each chunk of `embedding_batch` queries is embedded in one batch, searched concurrently
+    and all its (query, chunk) pairs are reranked together.
+    """
+    embedding_batch = batch_config.get('embedding_batch', 256)
+    for start in range(0, len(queries), embedding_batch):
+        chunk = queries[start:start + embedding_batch]
+        results = await search.abatch_similarity_search(chunk, k)
+        if rerank_mode:
+            scores = iter(await rerank.ascore_bulk([(query, doc.page_content) for query, docs in zip(chunk, results) for doc in docs]))
+            results = [rerank.sort_by_score(docs, [next(scores) for _ in docs]) for docs in results]
+        for index, (query, docs) in enumerate(zip(chunk, results), start):
+            yield {"index": index, "query": query, "result": [search.results_to_model(doc) for doc in docs]}
+
+async def batch_search(pipeline: str, queries: List[str], params: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Run `queries` through `pipeline` ("resources" for retrieval only, or an LLM pipeline), yielding each result as soon as it is done.
+    For the LLM pipelines every query is embedded up front in batches of `embedding_batch`, so their own embedding calls
+    hit the query embedding cache, then the queries run through `answer` at most `max_concurrency` at a time;
+    their concurrent reranks share cross-encoder batches through the micro-batcher.
+    """
+    if pipeline == "resources":
+        async for item in batch_resources(queries, params.get("k") or 5, params.get("rerank_mode", True)):
+            yield item
+        return
+    run = batch_pipelines(params)[pipeline]
+    embedding_batch = batch_config.get('embedding_batch', 256)
+    if config.get_database_config().get('embedding_cache', {}).get('enabled', False):
+        embeddings = db.get_embeddings()
+        with span("embedding"):
+            for start in range(0, len(queries), embedding_batch):
+                await asyncio.to_thread(embeddings.embed_documents, queries[start:start + embedding_batch])
+
+    semaphore = asyncio.Semaphore(batch_config.get('max_concurrency', 8))
+    async def run_one(index: int, query: str) -> Dict[str, Any]:
+        async with semaphore:
+            try:
+                return {"index": index, "query": query, "result": await run(query)}
+            except Exception as e:
+                print(f"Batch query {index} failed : ", e)
+                return {"index": index, "query": query, "error": str(e)}
+
+    tasks = [asyncio.ensure_future(run_one(index, query)) for index, query in enumerate(queries)]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        # The client went away: stop the queries that have not finished
+        for task in tasks:
+            if not task.done():
+                discard(task)
+
+llm_response_template = """
     Answer the question. If you can't 
     answer the question, reply "I don't know".
     Question: {question}
     """
 
-    prompt = ChatPromptTemplate.from_template(template)
-    llm_model = GoogleGenerativeAI(model=llm_model_name)
-
-    rag_chain = (
+# Built on first use and shared by every request
+llm_response_chain = lazy(lambda: (
     {"question": RunnablePassthrough()}
-    | prompt
-    | llm_model
+    | ChatPromptTemplate.from_template(llm_response_template)
+    | llm_profile("answer")
     | StrOutputParser()
-    )
+))
+
+async def get_llm_response(query:str) -> str:
+    rag_chain = llm_response_chain()
     default_text = "This question is not related to the book !! This is the answer based on my knowledge :\n\n"
-    return AIResults(text=default_text + rag_chain.invoke(query),ResourceCollection=[])
\ No newline at end of file
+    with span("generation"):
+        response = await rag_chain.ainvoke(query)
+    return AIResults(text=default_text + response,ResourceCollection=[])
+
+"""
+Streaming variants, each yields (event, data) pairs: one "resources" event first, then "token" events.
+"""
+
+async def prefetched_tokens(tokens: AsyncIterator[str]) -> Tuple[Optional[str], AsyncIterator[str]]:
+    """
+    Run `tokens` up to its first token, i.e. through retrieval and grading, so that work happens before
+    the first event and overlaps the router in speculative mode. Returns the first token (None if empty) and the rest.
+    """
+    try:
+        return await tokens.__anext__(), tokens
+    except StopAsyncIteration:
+        return None, tokens
+
+async def stream_self_rag(query:str, top_k) -> AsyncIterator[Tuple[str, Any]]:
+    first, tokens = await prefetched_tokens(self_rag.self_rag_stream(query=query, top_k = top_k))
+    yield "resources", []
+    yield "token", f"""Result of Self-RAG: \n\n"""
+    if first is None:
+        return
+    yield "token", first
+    async for token in tokens:
+        yield "token", token
+
+async def stream_crag(query:str, k:int, evaluator: Optional[str] = None) -> AsyncIterator[Tuple[str, Any]]:
+    first, tokens = await prefetched_tokens(crag.crag_process_stream(query=query, k = k, evaluator = evaluator))
+    yield "resources", []
+    yield "token", f"""Result of CRAG: \n\n"""
+    if first is None:
+        return
+    yield "token", first
+    async for token in tokens:
+        yield "token", token
+
+async def stream_adaptive_query(query:str, k:int = 3, rerank_mode: bool = True, query_category = "Auto") -> AsyncIterator[Tuple[str, Any]]:
+    resources, tokens = await get_adaptive_query_engine().astream_answer(query, k, rerank_mode, query_category)
+    print("resources : ", len(resources))
+    yield "resources", resources
+    yield "token", f"""Rerank_mode : {rerank_mode}, query_category : {query_category} \n\n"""
+    async for event in tokens:
+        yield event
+
+async def stream_llm_response(query:str) -> AsyncIterator[Tuple[str, Any]]:
+    yield "resources", []
+    yield "token", "This question is not related to the book !! This is the answer based on my knowledge :\n\n"
+    async for token in llm_response_chain().astream(query):
+        yield "token", token
\ No newline at end of file
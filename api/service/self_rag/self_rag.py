@@ -1,75 +1,139 @@
-from .utils import retrieval_chain, relevance_chain,\
-        generation_chain, support_chain, utility_chain
+from .utils import get_retrieval_chain, get_relevance_chain, get_batch_relevance_chain,\
+        get_generation_chain, get_generation_stream_chain, get_support_chain, get_utility_chain
         
 from data.pinecone import search as search
-import time
-       
-def self_rag(query, top_k):
+from service.concurrency import gather_bounded
+from config import config as config
+from monitoring.tracing import span
+from typing import AsyncIterator, List, Optional
+
+grading_config = config.get_grading_config()
+
+async def grade_context(query: str, context: str) -> str:
+    input_data = {"query": query, "context": context}
+    return (await get_relevance_chain().ainvoke(input_data)).response.strip().lower()
+
+async def grade_contexts_single_call(query: str, contexts: List[str]) -> Optional[List[str]]:
+    numbered_contexts = "\n\n".join(f"Context {i+1}: '{context}'" for i, context in enumerate(contexts))
+    input_data = {"query": query, "contexts": numbered_contexts, "num_contexts": len(contexts)}
+    relevances = (await get_batch_relevance_chain().ainvoke(input_data)).responses
+    if len(relevances) != len(contexts):
+        print(f"Single call grading returned {len(relevances)} grades for {len(contexts)} contexts")
+        return None
+    return [relevance.strip().lower() for relevance in relevances]
+
+async def grade_contexts(query: str, contexts: List[str]) -> List[str]:
+    """
+    Grade every context concurrently (bounded by grading.max_concurrency), or in one request when grading.mode is "single_call".
+    """
+    if grading_config.get('mode') == 'single_call' and len(contexts) > 1:
+        relevances = await grade_contexts_single_call(query, contexts)
+        if relevances is not None:
+            return relevances
+    return await gather_bounded([grade_context(query, context) for context in contexts],
+                                grading_config.get('max_concurrency', 4))
+
+async def find_relevant_contexts(query, top_k) -> Optional[List[str]]:
+    """
+    Steps 1-3: decide whether retrieval is necessary, retrieve and keep the relevant contexts.
+    Returns None when no retrieval is necessary.
+    """
     print(f"\nProcessing query: {query}")
     
     # Step 1: Determine if retrieval is necessary
     print("Step 1: Determining if retrieval is necessary...")
     input_data = {"query": query}
-    retrieval_decision = retrieval_chain.invoke(input_data).response.strip().lower()
+    with span("retrieval_decision"):
+        retrieval_decision = (await get_retrieval_chain().ainvoke(input_data)).response.strip().lower()
     print(f"Retrieval decision: {retrieval_decision}")
     
-    if retrieval_decision == 'yes':
-        # Step 2: Retrieve relevant documents
-        print("Step 2: Retrieving relevant documents...")
-        docs = search.similarity_search([query], k = top_k)
-        contexts = [doc.page_content for doc in docs]
-        print(f"Retrieved {len(contexts)} documents")
-        
-        # Step 3: Evaluate relevance of retrieved documents
-        print("Step 3: Evaluating relevance of retrieved documents...")
-        relevant_contexts = []
-        for i, context in enumerate(contexts):
-            input_data = {"query": query, "context": context}
-            relevance = relevance_chain.invoke(input_data).response.strip().lower()
-            print(f"Document {i+1} relevance: {relevance}")
-            if relevance == 'relevant':
-                relevant_contexts.append(context)
-            time.sleep(4)
+    if retrieval_decision != 'yes':
+        return None
+
+    # Step 2: Retrieve relevant documents
+    print("Step 2: Retrieving relevant documents...")
+    docs = await search.asimilarity_search([query], k = top_k)
+    contexts = [doc.page_content for doc in docs]
+    print(f"Retrieved {len(contexts)} documents")
+    
+    # Step 3: Evaluate relevance of retrieved documents
+    print("Step 3: Evaluating relevance of retrieved documents...")
+    relevant_contexts = []
+    with span("grading"):
+        relevances = await grade_contexts(query, contexts)
+    for i, (context, relevance) in enumerate(zip(contexts, relevances)):
+        print(f"Document {i+1} relevance: {relevance}")
+        if relevance == 'relevant':
+            relevant_contexts.append(context)
+    
+    print(f"Number of relevant contexts: {len(relevant_contexts)}")
+    return relevant_contexts
+
+async def select_best_response(query, relevant_contexts: List[str]) -> str:
+    """
+    Steps 4-6: generate a response per relevant context, assess its support and utility, and keep the best one.
+    """
+    # Step 4: Generate response using relevant contexts
+    print("Step 4: Generating responses using relevant contexts...")
+    responses = []
+    for i, context in enumerate(relevant_contexts):
+        print(f"Generating response for context {i+1}...")
+        input_data = {"query": query, "context": context}
+        response = (await get_generation_chain().ainvoke(input_data)).response
         
-        print(f"Number of relevant contexts: {len(relevant_contexts)}")
+        # Step 5: Assess support
+        print(f"Step 5: Assessing support for response {i+1}...")
+        input_data = {"response": response, "context": context}
+        support = (await get_support_chain().ainvoke(input_data)).response.strip().lower()
+        print(f"Support assessment: {support}")
         
-        # If no relevant contexts found, generate without retrieval
-        if not relevant_contexts:
-            print("No relevant contexts found. Generating without retrieval...")
-            input_data = {"query": query, "context": "No relevant context found."}
-            return generation_chain.invoke(input_data).response
-        time.sleep(4)
-        # Step 4: Generate response using relevant contexts
-        print("Step 4: Generating responses using relevant contexts...")
-        responses = []
-        for i, context in enumerate(relevant_contexts):
-            print(f"Generating response for context {i+1}...")
-            input_data = {"query": query, "context": context}
-            response = generation_chain.invoke(input_data).response
-            time.sleep(4)
-            
-            # Step 5: Assess support
-            print(f"Step 5: Assessing support for response {i+1}...")
-            input_data = {"response": response, "context": context}
-            support = support_chain.invoke(input_data).response.strip().lower()
-            time.sleep(4)
-            print(f"Support assessment: {support}")
-            
-            # Step 6: Evaluate utility
-            print(f"Step 6: Evaluating utility for response {i+1}...")
-            input_data = {"query": query, "response": response}
-            utility = int(utility_chain.invoke(input_data).response)
-            print(f"Utility score: {utility}")
-            
-            responses.append((response, support, utility))
+        # Step 6: Evaluate utility
+        print(f"Step 6: Evaluating utility for response {i+1}...")
+        input_data = {"query": query, "response": response}
+        utility = int((await get_utility_chain().ainvoke(input_data)).response)
+        print(f"Utility score: {utility}")
         
-        # Select the best response based on support and utility
-        print("Selecting the best response...")
-        best_response = max(responses, key=lambda x: (x[1] == 'fully supported', x[2]))
-        print(f"Best response support: {best_response[1]}, utility: {best_response[2]}")
-        return best_response[0]
-    else:
+        responses.append((response, support, utility))
+    
+    # Select the best response based on support and utility
+    print("Selecting the best response...")
+    best_response = max(responses, key=lambda x: (x[1] == 'fully supported', x[2]))
+    print(f"Best response support: {best_response[1]}, utility: {best_response[2]}")
+    return best_response[0]
+
+async def self_rag(query, top_k):
+    relevant_contexts = await find_relevant_contexts(query, top_k)
+    
+    if relevant_contexts is None:
         # Generate without retrieval
         print("Generating without retrieval...")
         input_data = {"query": query, "context": "No retrieval necessary."}
-        return generation_chain.invoke(input_data).response
\ No newline at end of file
+        with span("generation"):
+            return (await get_generation_chain().ainvoke(input_data)).response
+    
+    # If no relevant contexts found, generate without retrieval
+    if not relevant_contexts:
+        print("No relevant contexts found. Generating without retrieval...")
+        input_data = {"query": query, "context": "No relevant context found."}
+        with span("generation"):
+            return (await get_generation_chain().ainvoke(input_data)).response
+    
+    with span("critique"):
+        return await select_best_response(query, relevant_contexts)
+
+async def self_rag_stream(query, top_k) -> AsyncIterator[str]:
+    """
+    Same as self_rag, but streams the tokens when the response is generated without retrieved context.
+    With relevant contexts the best response is only known once every candidate has been assessed,
+    so it is yielded as a single chunk.
+    """
+    relevant_contexts = await find_relevant_contexts(query, top_k)
+    
+    if relevant_contexts is None or not relevant_contexts:
+        context = "No retrieval necessary." if relevant_contexts is None else "No relevant context found."
+        print("Streaming response without retrieval...")
+        async for token in get_generation_stream_chain().astream({"query": query, "context": context}):
+            yield token
+        return
+    
+    yield await select_best_response(query, relevant_contexts)
\ No newline at end of file
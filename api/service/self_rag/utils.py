@@ -2,12 +2,17 @@ import os
 import sys
 from dotenv import load_dotenv
 from langchain.prompts import PromptTemplate
-from langchain_google_genai import ChatGoogleGenerativeAI
+from service.llm import llm_profile, lazy
 from langchain_core.pydantic_v1 import BaseModel, Field
+from langchain_core.output_parsers import StrOutputParser
+from typing import List
 
 
-llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash-latest", temperature=0.8, top_p=0.5)
-llm1 = ChatGoogleGenerativeAI(model="gemini-1.0-pro-latest", temperature=0.8, top_p=0.5)
+def get_llm():
+    return llm_profile("self_rag_grader")
+
+def get_llm1():
+    return llm_profile("self_rag_generation")
 
 class RetrievalResponse(BaseModel):
     response: str = Field(..., title="""Determine whether the content in the book "How to Win Friends and Influence People" can answer the query""", description="Output only 'Yes' or 'No'.")
@@ -23,6 +28,13 @@ relevance_prompt = PromptTemplate(
     template="Given the query '{query}' and the context '{context}', determine if the context is relevant. Output only 'Relevant' or 'Irrelevant'."
 )
 
+class BatchRelevanceResponse(BaseModel):
+    responses: List[str] = Field(..., title="Determines if each context is relevant", description="One entry per context, in the given order. Each entry is only 'Relevant' or 'Irrelevant'.")
+batch_relevance_prompt = PromptTemplate(
+    input_variables=["query", "contexts", "num_contexts"],
+    template="Given the query '{query}' and the following {num_contexts} numbered contexts, determine for each context if it is relevant. Output a list of exactly {num_contexts} entries, in order, each only 'Relevant' or 'Irrelevant'.\n\n{contexts}"
+)
+
 class GenerationResponse(BaseModel):
     response: str = Field(..., title="Generated response", description="The generated response.")
 generation_prompt = PromptTemplate(
@@ -44,9 +56,12 @@ utility_prompt = PromptTemplate(
     template="Given the query '{query}' and the response '{response}', rate the utility of the response from 1 to 5."
 )
 
-# Create LLMChains for each step
-retrieval_chain = retrieval_prompt | llm1.with_structured_output(RetrievalResponse)
-relevance_chain = relevance_prompt | llm.with_structured_output(RelevanceResponse)
-generation_chain = generation_prompt | llm1.with_structured_output(GenerationResponse)
-support_chain = support_prompt | llm.with_structured_output(SupportResponse)
-utility_chain = utility_prompt | llm1.with_structured_output(UtilityResponse)
\ No newline at end of file
+# Create LLMChains for each step, built on first use
+get_retrieval_chain = lazy(lambda: retrieval_prompt | get_llm1().with_structured_output(RetrievalResponse))
+get_relevance_chain = lazy(lambda: relevance_prompt | get_llm().with_structured_output(RelevanceResponse))
+get_batch_relevance_chain = lazy(lambda: batch_relevance_prompt | get_llm().with_structured_output(BatchRelevanceResponse))
+get_generation_chain = lazy(lambda: generation_prompt | get_llm1().with_structured_output(GenerationResponse))
+get_support_chain = lazy(lambda: support_prompt | get_llm().with_structured_output(SupportResponse))
+get_utility_chain = lazy(lambda: utility_prompt | get_llm1().with_structured_output(UtilityResponse))
+# Plain text generation, used when streaming the response
+get_generation_stream_chain = lazy(lambda: generation_prompt | get_llm1() | StrOutputParser())
\ No newline at end of file
@@ -0,0 +1,46 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class Flight:
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller starts the computation in its own task,
+    later callers wait on that task and get the same result (or exception).
+    The task is shielded from the cancellation of any single waiter, e.g. a client that disconnects,
+    and only cancelled when every waiter is gone. It runs in the context of the first caller,
+    so its LLM calls and stage timings are recorded in that caller's request trace.
+    """
+    def __init__(self):
+        self.flights: Dict[Hashable, Flight] = {}
+
+    def __len__(self) -> int:
+        return len(self.flights)
+
+    def _forget(self, key: Hashable, flight: Flight):
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Await `fn()`, or the in-flight call with the same key. Returns (result, whether it was shared)."""
+        flight = self.flights.get(key)
+        shared = flight is not None
+        if flight is None:
+            flight = Flight(asyncio.ensure_future(fn()))
+            self.flights[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task), shared
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Every waiter was cancelled: nobody wants the result any more
+                self._forget(key, flight)
+                flight.task.cancel()
+                flight.task.add_done_callback(lambda t: t.cancelled() or t.exception())
@@ -0,0 +1,65 @@
+import time
+import asyncio
+from typing import Any, Dict
+from data.pinecone import init as db
+from . import rerank as rerank
+from . import local_classifier as local_classifier
+from . import search as search
+from . import route as route
+from . import llm as llm
+from .crag import utils as crag_utils
+from .self_rag import utils as self_rag_utils
+
+status: Dict[str, Any] = {"ready": False, "error": None, "durations": {}}
+
+def timed(name, fn):
+    def run():
+        start = time.perf_counter()
+        result = fn()
+        status["durations"][name] = round(time.perf_counter() - start, 3)
+        return result
+    return run
+
+def load_retrieval():
+    db.get_vectorstore()
+    db.get_sparse_index()
+    # One dummy forward pass so the first real query doesn't pay for lazy kernel / tokenizer setup
+    db.get_embeddings().embed_documents(["warm up"])
+    local_classifier.get_classifier()
+
+def load_rerank():
+    rerank.get_cross_encoder()
+    rerank.score_pairs("warm up", ["warm up"])
+
+def load_llm_clients():
+    route.get_routing_chain()
+    search.llm_response_chain()
+    search.get_adaptive_query_engine()
+    crag_utils.get_llm()
+    crag_utils.get_llm1()
+    self_rag_utils.get_llm()
+    self_rag_utils.get_llm1()
+
+async def warm_up():
+    """
+    Load the embedding model, vector store, cross-encoder and LLM clients in parallel, then mark the service ready.
+    """
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(
+            asyncio.to_thread(timed("retrieval", load_retrieval)),
+            asyncio.to_thread(timed("rerank", load_rerank)),
+            asyncio.to_thread(timed("llm_clients", load_llm_clients)),
+        )
+    except Exception as e:
+        print("Warm-up failed : ", e)
+        status["error"] = str(e)
+        return
+    # The clients were built in worker threads, without an async transport
+    llm.attach_async_transport()
+    status["durations"]["total"] = round(time.perf_counter() - start, 3)
+    status["ready"] = True
+    print("Warm-up done : ", status["durations"])
+
+def is_ready() -> bool:
+    return status["ready"]
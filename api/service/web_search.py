@@ -0,0 +1,147 @@
+import json
+import time
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from config import config as config
+from data.local.bm25 import BM25Index
+from monitoring import metrics as metrics
+from monitoring.tracing import span
+from .llm import lazy
+
+web_search_config = config.get_web_search_config()
+
+# Each result is a dict with "title", "link" and "snippet"
+WebResult = Dict[str, str]
+
+
+class WebSearchProvider(ABC):
+    """A web search engine, called from a worker thread."""
+    name = "base"
+
+    @abstractmethod
+    def search(self, query: str, max_results: int) -> List[WebResult]:
+        ...
+
+
+class DuckDuckGoProvider(WebSearchProvider):
+    name = "duckduckgo"
+
+    def __init__(self, region: str = "wt-wt", safesearch: str = "moderate"):
+        # Needs the duckduckgo-search package
+        from langchain_community.utilities import DuckDuckGoSearchAPIWrapper
+        self.wrapper = DuckDuckGoSearchAPIWrapper(region=region, safesearch=safesearch)
+
+    def search(self, query: str, max_results: int) -> List[WebResult]:
+        return [{"title": result.get("title", "Untitled"), "link": result.get("link", ""), "snippet": result.get("snippet", "")}
+                for result in self.wrapper.results(query, max_results)]
+
+
+class LocalProvider(WebSearchProvider):
+    """
+    Offline stand-in: results from a JSONL file of {"title", "link", "snippet"} records, ranked by BM25 against the query.
+    """
+    name = "local"
+
+    def __init__(self, path: str):
+        with open(path, "r", encoding="utf-8") as file:
+            self.results = [json.loads(line) for line in file if line.strip()]
+        self.index = BM25Index([{"page_content": result.get("snippet", ""), "metadata": {"title": result.get("title", "")}}
+                                for result in self.results])
+
+    def search(self, query: str, max_results: int) -> List[WebResult]:
+        scores, _ = self.index.scores(query)
+        return [self.results[int(doc_id)] for doc_id in scores.argsort()[::-1][:max_results] if scores[doc_id] > 0]
+
+
+class WebResultCache:
+    """Results by normalized query, expiring after `ttl_seconds`, least recently used evicted beyond `max_entries`."""
+    def __init__(self, ttl_seconds: float = 3600, max_entries: int = 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, Tuple[float, List[WebResult]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(query: str) -> str:
+        return " ".join(query.lower().split())
+
+    def get(self, query: str) -> Optional[List[WebResult]]:
+        key = self.key(query)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.ttl_seconds:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, query: str, results: List[WebResult]):
+        with self._lock:
+            self.entries[self.key(query)] = (time.monotonic(), results)
+            self.entries.move_to_end(self.key(query))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+def build_provider(provider: str) -> WebSearchProvider:
+    if provider == 'local':
+        return LocalProvider(web_search_config.get('local', {}).get('path', 'data/web/results.jsonl'))
+    if provider == 'duckduckgo':
+        duckduckgo_config = web_search_config.get('duckduckgo', {})
+        return DuckDuckGoProvider(duckduckgo_config.get('region', 'wt-wt'), duckduckgo_config.get('safesearch', 'moderate'))
+    raise ValueError(f"Unknown web search provider: {provider}")
+
+def load_provider() -> Optional[WebSearchProvider]:
+    """
+    The configured provider, or None if it cannot be built (e.g. duckduckgo-search is not installed).
+    The failure is kept, so it is not retried on every search.
+    """
+    provider = web_search_config.get('provider', 'duckduckgo')
+    try:
+        return build_provider(provider)
+    except Exception as e:
+        print(f"Web search provider {provider} is unavailable, CRAG goes on without web results : ", e)
+        return None
+
+get_provider = lazy(load_provider)
+
+cache_config = web_search_config.get('cache', {})
+cache = WebResultCache(ttl_seconds=cache_config.get('ttl_seconds', 3600), max_entries=cache_config.get('max_entries', 1024))
+
+async def asearch(query: str) -> List[WebResult]:
+    """
+    Web results for `query`, from the cache or the configured provider.
+    A search slower than `timeout_s`, or failing, yields no results rather than stalling the caller.
+    """
+    if cache_config.get('enabled', True):
+        results = cache.get(query)
+        if results is not None:
+            metrics.web_searches.labels("cache_hit").inc()
+            return results
+    with span("web_search"):
+        # None when the provider could not be built
+        provider = await asyncio.to_thread(get_provider)
+        if provider is None:
+            metrics.web_searches.labels("unavailable").inc()
+            return []
+        try:
+            # The worker thread cannot be interrupted; past the deadline its result is dropped
+            results = await asyncio.wait_for(asyncio.to_thread(provider.search, query, web_search_config.get('max_results', 4)),
+                                             timeout=web_search_config.get('timeout_s', 5))
+        except asyncio.TimeoutError:
+            print(f"Web search ({provider.name}) timed out for : {query}")
+            metrics.web_searches.labels("timeout").inc()
+            return []
+        except Exception as e:
+            print(f"Web search ({provider.name}) failed : ", e)
+            metrics.web_searches.labels("error").inc()
+            return []
+    metrics.web_searches.labels("provider").inc()
+    if cache_config.get('enabled', True):
+        cache.put(query, results)
+    return results
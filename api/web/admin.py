@@ -0,0 +1,22 @@
+from fastapi import APIRouter
+from service import search as search
+from typing import Literal, Optional
+
+router = APIRouter(prefix="/admin")
+
+
+@router.get("/answer_cache")
+async def get_answer_cache() -> dict:
+    return search.answer_cache.stats()
+
+
+@router.delete("/answer_cache")
+async def invalidate_answer_cache(endpoint: Optional[Literal["self_rag", "crag", "adaptive_query"]] = None) -> dict:
+    removed = search.answer_cache.invalidate(endpoint)
+    print(f"Answer cache invalidated : {removed} entries ({endpoint or 'all endpoints'})")
+    return {"removed": removed}
+
+
+@router.get("/strategy_bandit")
+async def get_strategy_bandit() -> dict:
+    return search.bandit.get_bandit().stats()
\ No newline at end of file
@@ -1,37 +1,99 @@
-from fastapi import APIRouter
+import json
+from fastapi import APIRouter, HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from service import search as search 
 from service import route as route 
 from model.resource import Resource
 from model.airesults import AIResults
-from typing import Literal
+from model.feedback import Feedback
+from model.batch import BatchRequest
+from typing import Any, AsyncIterator, Callable, Literal, Optional, Tuple
 
 router = APIRouter(prefix="/search")
 
 
+@router.post("/feedback")
+async def post_feedback(feedback: Feedback) -> dict:
+    arm = search.submit_feedback(feedback.feedback_id, feedback.score)
+    if arm is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired feedback id")
+    return arm
+
+
+@router.post("/batch")
+async def post_batch(request: BatchRequest) -> StreamingResponse:
+    """
+    Many queries through one pipeline. Results stream back as NDJSON, one {"index", "query", "result" | "error"} line
+    per query in completion order.
+    """
+    max_queries = search.batch_config.get('max_queries', 10000)
+    if len(request.queries) > max_queries:
+        raise HTTPException(status_code=413, detail=f"At most {max_queries} queries per batch")
+    params = request.model_dump(exclude={"pipeline", "queries"})
+
+    async def lines() -> AsyncIterator[str]:
+        async for item in search.batch_search(request.pipeline, request.queries, params):
+            yield json.dumps(jsonable_encoder(item)) + "\n"
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
 @router.get("/{query}")
-def get_search(query) -> list[Resource]:
-    return search.get_query(query)
+async def get_search(query) -> list[Resource]:
+    return await search.get_query(query)
 
 
 @router.get("/self_rag/{query}")
-def get_self_rag(query, top_k : int = 3) -> AIResults:
-    if route.routing_query(query):
-        print("This question is related to the book !!")
-        return search.do_self_rag(query, top_k)
-    return search.get_llm_response(query)
+async def get_self_rag(query, top_k : int = 3) -> AIResults:
+    return await search.answer("self_rag", query, {"top_k": top_k},
+                               lambda: search.do_self_rag(query, top_k))
 
 
 @router.get("/crag/{query}")
-def get_crag(query, k : int = 4) -> AIResults:
-    if route.routing_query(query):
-        print("This question is related to the book !!")
-        return search.do_crag(query, k)
-    return search.get_llm_response(query)
+async def get_crag(query, k : int = 4, evaluator: Optional[Literal["llm", "cross_encoder"]] = None) -> AIResults:
+    return await search.answer("crag", query, {"k": k, "evaluator": evaluator},
+                               lambda: search.do_crag(query, k, evaluator))
 
 
 @router.get("/adaptive_query/{query}")
-def get_adaptive_query(query, k:int = 5, rerank_mode: bool = True, query_category = Literal["Auto", "Factual", "Analytical"]) -> AIResults:
-    if route.routing_query(query):
-        print("This question is related to the book !!")
-        return search.get_adaptive_query(query, k, rerank_mode, query_category)
-    return search.get_llm_response(query)
+async def get_adaptive_query(query, k:int = 5, rerank_mode: bool = True, query_category: Literal["Auto", "Factual", "Analytical"] = "Auto") -> AIResults:
+    return await search.answer("adaptive_query", query, {"k": k, "rerank_mode": rerank_mode, "query_category": query_category},
+                               lambda: search.get_adaptive_query(query, k, rerank_mode, query_category))
+
+
+
+"""
+Server-sent events: "resources" is sent as soon as retrieval is done, then one "token" event per generated chunk,
+then "feedback" with the id to rate the answer (adaptive queries only), then "done" (or "error").
+"""
+
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+async def routed_event_stream(query, stream_pipeline: Callable[[], AsyncIterator[Tuple[str, Any]]]) -> AsyncIterator[str]:
+    try:
+        async for event, data in search.routed_stream(query, stream_pipeline):
+            yield sse_event(event, data)
+        yield sse_event("done", {})
+    except Exception as e:
+        print("Streaming error : ", e)
+        yield sse_event("error", {"detail": str(e)})
+
+def sse_response(events: AsyncIterator[str]) -> StreamingResponse:
+    return StreamingResponse(events, media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.get("/stream/self_rag/{query}")
+async def stream_self_rag(query, top_k : int = 3) -> StreamingResponse:
+    return sse_response(routed_event_stream(query, lambda: search.stream_self_rag(query, top_k)))
+
+
+@router.get("/stream/crag/{query}")
+async def stream_crag(query, k : int = 4, evaluator: Optional[Literal["llm", "cross_encoder"]] = None) -> StreamingResponse:
+    return sse_response(routed_event_stream(query, lambda: search.stream_crag(query, k, evaluator)))
+
+
+@router.get("/stream/adaptive_query/{query}")
+async def stream_adaptive_query(query, k:int = 5, rerank_mode: bool = True, query_category: Literal["Auto", "Factual", "Analytical"] = "Auto") -> StreamingResponse:
+    return sse_response(routed_event_stream(query, lambda: search.stream_adaptive_query(query, k, rerank_mode, query_category)))
\ No newline at end of file